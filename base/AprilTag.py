@@ -1,13 +1,188 @@
+import math
+import time
+import struct
 import socket
 import socketserver
 import threading
 
-global tagdic
+import TagPoseStore
+
+#every pose the cameras have reported, by tag ID
+poses = TagPoseStore.TagPoseStore()
+
+
+#one field camera, found by the port it sends to
+#x, y, z (m) and angle (rad, about the vertical) place the camera's frame in the field's
+class Camera:
+	def __init__(self, port, x=0.0, y=0.0, z=0.0, angle=0.0):
+		self.port = port
+		self.x = x
+		self.y = y
+		self.z = z
+		self.angle = angle
+		self.cos = math.cos(angle)
+		self.sin = math.sin(angle)
+
+	#x y z yaw pitch roll the camera sent, in the field frame
+	def toField(self, pose):
+		pose = list(pose)
+		x, y = pose[0], pose[1]
+		pose[0] = self.x + self.cos * x - self.sin * y
+		pose[1] = self.y + self.sin * x + self.cos * y
+		pose[2] += self.z
+		heading = TagPoseStore.HEADING - TagPoseStore.X
+		pose[heading] = math.atan2(math.sin(pose[heading] + self.angle), math.cos(pose[heading] + self.angle))
+		return pose
+
+	#how far the tag was from the camera
+	@staticmethod
+	def distance(pose):
+		return math.sqrt(pose[0] ** 2 + pose[1] ** 2 + pose[2] ** 2)
+
+	#cameras from a file, one "port,x,y,z,angle" line per camera (m, degrees)
+	#blank lines and lines starting with # are skipped
+	@staticmethod
+	def load(filename):
+		cameras = []
+		with open(filename) as f:
+			for line in f:
+				line = line.strip()
+				if not line or line.startswith('#'):
+					continue
+				port, x, y, z, angle = line.split(',')
+				cameras.append(Camera(int(port), float(x), float(y), float(z), math.radians(float(angle))))
+		return cameras
+
+#binary tag frame, every tag from one camera frame (field/src/Field.cpp)
+#magic, tag count, capture time, then per tag ID, x, y, z, yaw, ptc, rol, distance from the camera
+TAG_FRAME_MAGIC = 0xA7
+TAG_FRAME_HEADER = struct.Struct('<BHd')
+TAG_FRAME_TAG = struct.Struct('<i7d')
+
+#whole binary frame, tags are (tagID, [x, y, z, yaw, ptc, rol]) pairs
+def makeTagFrame(cameraTime, tags, distances):
+	frame = bytearray(TAG_FRAME_HEADER.pack(TAG_FRAME_MAGIC, len(tags), cameraTime))
+	for (tagid, pose), distance in zip(tags, distances):
+		frame += TAG_FRAME_TAG.pack(tagid, *(list(pose[:6]) + [distance]))
+	return bytes(frame)
+
+#binary frame that starts at start in view, returns (cameraTime, tags, distances)
+def parseTagFrame(view, start, length):
+	magic, count, cameraTime = TAG_FRAME_HEADER.unpack_from(view, start)
+	tags = []
+	distances = []
+	for values in TAG_FRAME_TAG.iter_unpack(view[start + TAG_FRAME_HEADER.size:start + length]):
+		tags.append((values[0], list(values[1:7])))
+		distances.append(values[7])
+	return cameraTime, tags, distances
+
+
+# tag reports off the camera's stream, either kind:
+# binary frames (see TAG_FRAME_*), told apart by their first byte, or the old
+# "<length><one byte><payload>" with payload "tagID,x,y,z,yaw,ptc,rol" per tag
+# a length of 0 (or no digits) ends the stream
+# recv_into a buffer that every complete report is parsed straight out of,
+# a report split across reads waits at the front of the buffer for the rest
+class TagReader:
+	def __init__(self, sock, size=4096):
+		self.sock = sock
+		self.buf = bytearray(size)
+		self.view = memoryview(self.buf)
+		self.start = 0	#first byte not yet parsed
+		self.end = 0	#one past the last byte recieved
+		self.need = 0	#bytes the report at the front needs in all, 0 if not known yet
+		self.bad = 0	#reports that didn't parse and were skipped
+		self.ended = False	#camera sent the end of its stream
+
+	#parse every complete report in the buffer
+	#returns (cameraTime, tags, distances) batches: one per binary frame, and one for
+	#each run of ASCII reports, which come without a time or distances (None)
+	def parseTags(self):
+		buf = self.buf
+		batches = []
+		tags = []
+		while self.start < self.end:
+			if buf[self.start] == TAG_FRAME_MAGIC:
+				if tags:
+					batches.append((None, tags, None))
+					tags = []
+				if self.end - self.start < TAG_FRAME_HEADER.size:
+					self.need = TAG_FRAME_HEADER.size
+					break
+				count = int.from_bytes(buf[self.start + 1:self.start + 3], 'little')
+				length = TAG_FRAME_HEADER.size + count * TAG_FRAME_TAG.size
+				if self.end - self.start < length:
+					self.need = length
+					break
+				batches.append(parseTagFrame(self.view, self.start, length))
+				self.start += length
+				self.need = 0
+				continue
+
+			i = self.start
+			length = 0
+			while i < self.end and 48 <= buf[i] <= 57:
+				length = length * 10 + buf[i] - 48
+				i += 1
+			if i == self.end:
+				break	#length or the byte after it isn't in yet
+			if length == 0:
+				self.ended = True
+				break
+			first = i + 1
+			last = first + length
+			if last > self.end:
+				self.need = last - self.start
+				break
+			try:
+				tags.append(parseTag(buf, first, last))
+			except ValueError:
+				self.bad += 1
+			self.start = last
+			self.need = 0
+		if tags:
+			batches.append((None, tags, None))
+		return batches
+
+	#one recv_into the free space, returns the batches that completed
+	def read(self):
+		if self.ended:
+			raise EOFError("end of tag stream")
+		pending = self.end - self.start
+		if self.start > 0:
+			self.buf[:pending] = self.buf[self.start:self.end]
+			self.start, self.end = 0, pending
+		#report bigger than the whole buffer, or no room left
+		size = max(self.need, self.end + 1)
+		if size > len(self.buf):
+			self.view.release()
+			self.buf.extend(bytes(max(size, 2 * len(self.buf)) - len(self.buf)))
+			self.view = memoryview(self.buf)
+
+		n = self.sock.recv_into(self.view[self.end:])
+		if n == 0:
+			raise EOFError("connection closed")
+		self.end += n
+		return self.parseTags()
+
+
+#"tagID,x,y,..." between first and last in buf, numbers read right out of the buffer
+def parseTag(buf, first, last):
+	comma = buf.find(b',', first, last)
+	if comma < 0:
+		comma = last
+	tagid = int(buf[first:comma])
+	pose = []
+	start = comma + 1
+	while start < last:
+		comma = buf.find(b',', start, last)
+		if comma < 0:
+			comma = last
+		pose.append(float(buf[start:comma]))
+		start = comma + 1
+	return tagid, pose
+
 
-tagdic = {}
-def tagdict():
-	print(tagdic)
-	return tagdic
 class MyTCPHandler(socketserver.BaseRequestHandler):
 	"""
 	The request handler class for our server.
@@ -18,55 +193,44 @@ class MyTCPHandler(socketserver.BaseRequestHandler):
 	"""
 
 	def handle(self):
-		self.tag = {}
-		while True:
-			length = 0
+		camera = self.server.camera
+		reader = TagReader(self.request)
+		try:
 			while True:
-				ca = self.request.recv(1).strip()
-				c = ca.decode()
-				if ((c >= '0') and (c <= '9')):
-					length = (length * 10) + int(c)
-				else:
-					break
+				for cameraTime, tags, distances in reader.read():
+					if distances is None:
+						distances = [Camera.distance(pose) for tagid, pose in tags]
+					tags = [(tagid, camera.toField(pose)) for tagid, pose in tags]
+					poses.updateMany(tags, cameraTime, time.time(), camera.port, distances)
+		except (EOFError, OSError):
+			pass
+		print("done")
 
-			#print("length = ", length)
-			if length > 0:
-				self.length = length
-				self.interpretMsg()
-			else:
-				break
-			# print "c = ", c
-			# print length
-			# data = self.request.recv(length)
-			# print "full msg data: ", data
 
-		print("done")
-		quit()
-
-	def interpretMsg(self):
-		while True:
-			self.TagData = self.request.recv(self.length)
-			self.TagData = self.TagData.decode()
-			self.TagData = self.TagData.split(',')
-			#print(self.TagData)
-			self.dictIt()
-			break
-
-	def dictIt(self):
-		global tagdic
-		tagid = self.TagData.pop(0)
-		self.tag[int(tagid)] = list(map(float,self.TagData))
-		tagdic = self.tag
-		#print(self.tag)
-		#print(tagdict)
+class CameraServer(socketserver.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+	def __init__(self, address, camera):
+		self.camera = camera
+		socketserver.ThreadingTCPServer.__init__(self, address, MyTCPHandler)
 
 
 class AprilTag:
+	#cameras defaults to the one camera on 9999, right on the field frame
+	def __init__(self, cameras=None):
+		self.cameras = cameras if cameras else [Camera(9999)]
+
+	#serves every camera, each on its own thread, doesn't return
 	def run(self):
-		[self.HOST, self.PORT] = ["localhost", 9999]
-		print("hosting on port",  self.PORT)
-		server = socketserver.TCPServer((self.HOST, self.PORT), MyTCPHandler)
-		server.serve_forever()
+		self.HOST = "localhost"
+		servers = []
+		for camera in self.cameras:
+			print("hosting on port", camera.port)
+			servers.append(CameraServer((self.HOST, camera.port), camera))
+		for server in servers[1:]:
+			threading.Thread(target=server.serve_forever, daemon=True).start()
+		servers[0].serve_forever()
 
 if __name__ == "__main__":
 	print("making instance")
@@ -0,0 +1,71 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# ArmGeometry.py
+#
+# Where the gas sensors sit on the robot
+# one row per sensor: distance out from the robot centre (m) and angle
+# from the robot's heading (rad), in the order the Teensy reports them
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import math
+
+import numpy as np
+
+
+class ArmGeometry:
+	def __init__(self, arms):
+		arms = np.asarray(arms, dtype=np.float64).reshape(-1, 2)
+		self.distance = arms[:, 0]
+		self.angle = arms[:, 1]
+
+	def __len__(self):
+		return len(self.distance)
+
+	# count sensors spread evenly around the robot, first one straight ahead
+	@classmethod
+	def evenlySpaced(cls, count=4, distance=.25):
+		return cls([(distance, (2 * math.pi / count) * i) for i in range(count)])
+
+	# table from a file, one "distance,angle" line per sensor (m, degrees)
+	# blank lines and lines starting with # are skipped
+	@classmethod
+	def load(cls, filename):
+		arms = []
+		with open(filename) as f:
+			for line in f:
+				line = line.strip()
+				if not line or line.startswith('#'):
+					continue
+				distance, angle = line.split(',')
+				arms.append((float(distance), math.radians(float(angle))))
+		return cls(arms)
+
+	# where every reading was taken
+	# poses is N x 3 (x, y, theta), one pose per row of readings
+	# returns x and y, each N x sensors, in the same frame as the poses
+	def project(self, poses):
+		poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+		heading = poses[:, 2:3] + self.angle
+		x = poses[:, 0:1] + self.distance * np.cos(heading)
+		y = poses[:, 1:2] + self.distance * np.sin(heading)
+		return x, y
+
+	# readings flattened into SampleStore rows
+	# t is N long, poses N x 3, gas N x sensors
+	# returns t, x, y, concentration, sensor_index, each N * sensors long
+	def samples(self, t, poses, gas):
+		gas = np.asarray(gas, dtype=np.float64).reshape(-1, len(self))
+		x, y = self.project(poses)
+		n = gas.shape[0]
+		t = np.repeat(np.asarray(t, dtype=np.float64).reshape(n), len(self))
+		sensor = np.tile(np.arange(len(self)), n)
+		return t, x.ravel(), y.ravel(), gas.ravel(), sensor
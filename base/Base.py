@@ -22,86 +22,224 @@ import pickle
 import threading
 import argparse
 import time
+import asyncio
+import concurrent.futures
 
 import Robot
 import AprilTag
+import Fleet
+import Scheduler
+import ArmGeometry
+import RunLog
+import SampleStore
+import MapWriter
+import Renderer
+import Colormap
 
 sys.path.append('libs/')
-from libs.graphics import *
 from libs.custom_libs import encoding_TCP as encode
 
 class Base:
-	def __init__(self,numRob, ip, inputs):
+	# connections the OS will queue up while we get around to accepting
+	BACKLOG = 16
+
+	def __init__(self,numRob, ip, inputs, duplex=False, hz=0, arms=None, fsync='close', hotRows=0, cameras=None, mapFps=0, gif=False, showFps=0, colormap=None):
 		self.keepRunning = True
-		self.numRob = numRob
 		self.inputs = inputs
+		self.cameras = cameras	# AprilTag.Cameras, None for the one camera on 9999
+		self.duplex = duplex
+		self.hz = hz
 
 		# setup TCP server and listeing
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		# restarting the base shouldn't have to wait out the old socket
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 		PORT = 5732
 		server_address = (ip, PORT)
 		print("starting up on %s port %s" % server_address)
 		self.sock.bind(server_address)
 
 		# Listen
-		self.sock.listen(1)
+		self.sock.listen(Base.BACKLOG)
 		print("Waiting for connections")
 
 		# min and max concentrations
 		self.minCon = 10000
 		self.maxCon = 0
 
-		self.robots = []
+		# one binary log for the whole run
+		self.log = RunLog.RunLogger("run - %s.plog" % time.time(), fsync=fsync)
+		print(self.log.filename)
+
+		# gas readings, only the newest hotRows per robot kept in memory if set
+		if hotRows:
+			self.gasses = SampleStore.SampleStore(hotRows=hotRows, spill="gas - %s.spill" % time.time())
+		else:
+			self.gasses = SampleStore.SampleStore()
+
+		# robots join and leave as they connect and drop
+		self.fleet = Fleet.Fleet(numRob, duplex, scheduled=hz > 0, arms=arms, log=self.log, store=self.gasses)
 		self.robotThreads = []
+		# fixed rate planning for the whole fleet
+		self.scheduler = Scheduler.Scheduler(self.fleet, hz) if hz > 0 else None
+		# maps drawn on threads of their own, to files (works without a display) and to a window
+		self.renderers = []
+		if mapFps > 0:
+			self.renderers.append(MapWriter.MapWriter(self.fleet, "map - %s" % time.time(), mapFps, gif, colormap=colormap))
+		if showFps > 0:
+			self.renderers.append(Renderer.MapWindow(self.fleet, showFps, colormap=colormap))
+
+	def startAprilTag(self):
+		if self.inputs == 0:
+			aprilTag = AprilTag.AprilTag(self.cameras)
+			aprilThread = threading.Thread(target=aprilTag.run, daemon=True)
+			aprilThread.start()
+
+	def startRenderers(self):
+		for renderer in self.renderers:
+			renderer.start()
 
 	def run(self):
-		# start april tag server and put in robot thread
-		# catch all robots
+		# start april tag server before any robot needs it
+		self.startAprilTag()
+		if self.scheduler is not None:
+			self.scheduler.start()
+		self.startRenderers()
+		# catch robots whenever they show up, for as long as we're running
 		# all yur robots are belong to us
 		# make a thread for every robot communication
-		c = 0
-		while c < self.numRob:	# number of robots?
-			conn, client_address = self.sock.accept()
+		self.sock.settimeout(1)	# so keepRunning gets checked
+		while self.keepRunning:
+			try:
+				conn, client_address = self.sock.accept()
+			except socket.timeout:
+				continue
+			conn.setblocking(True)
 			print("Connection from", client_address)
-			ID = encode.recievePacket(sock=conn)
-
-			robot = Robot.Robot(ID, conn)
-			thread = threading.Thread(target=robot.run)
+			thread = threading.Thread(target=self.serveRobot, args=(conn,))
+			thread.start()
+			self.robotThreads = [t for t in self.robotThreads if t.is_alive()]
 			self.robotThreads.append(thread)
-			self.robots.append(robot)
-			c += 1
-		print(self.robotThreads)
-		if self.inputs == 0:
-			aprilTag = AprilTag.AprilTag()
-			aprilThread = threading.Thread(target=aprilTag.run)
-			self.robotThreads.append(aprilThread)
-			self.robots.append(aprilTag)
-		print(self.robotThreads)
-		print(len(self.robotThreads))
-
-		for i in range(0,len(self.robotThreads)):	# start threads
-			self.robotThreads[i].start()
-		for i in range(0,len(self.robotThreads)):	# join thread
-			self.robotThreads[i].join()
-		# make sure to kill the threads!
-		for thread in self.robots:
-			thread.terminate()
+
+	# one robot connection, start to finish
+	def serveRobot(self, conn):
+		ID = encode.recievePacket(sock=conn)
+		robot = self.fleet.join(ID, conn) if ID is not None else None
+		if robot is None:
+			print("Turning away robot", ID)
+			conn.close()
+			return
+		try:
+			robot.run()
+		finally:
+			self.fleet.leave(robot, conn)
+			conn.close()
+
+	# asyncio server mode
+	# one event loop takes every robot connection and runs a coroutine per
+	# robot instead of a thread, planning and mapping go to a worker pool
+	# Ctrl-C ends it like it ends run(), once serve has let every robot go
+	def runAsync(self, workers):
+		try:
+			asyncio.run(self.serve(workers))
+		except KeyboardInterrupt:
+			pass
+
+	async def serve(self, workers):
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+		self.robotTasks = set()
+		self.startAprilTag()
+		self.startRenderers()
+
+		self.sock.setblocking(False)
+		server = await asyncio.start_server(self.handleRobot, sock=self.sock)
+		try:
+			await server.serve_forever()
+		finally:
+			# robots still planning need the workers, stop them first
+			server.close()
+			for task in self.robotTasks:
+				task.cancel()
+			await asyncio.gather(*self.robotTasks, return_exceptions=True)
+			self.executor.shutdown(wait=False)
+
+	# connection callback, runs the robot until it is done
+	# or until the server shuts down and cancels it
+	async def handleRobot(self, reader, writer):
+		task = asyncio.current_task()
+		self.robotTasks.add(task)
+		try:
+			await self.serveRobotAsync(reader, writer)
+		except asyncio.CancelledError:
+			writer.close()
+		finally:
+			self.robotTasks.discard(task)
+
+	async def serveRobotAsync(self, reader, writer):
+		print("Connection from", writer.get_extra_info('peername'))
+		try:
+			ID = await encode.recievePacketAsync(reader)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			ID = None
+		robot = self.fleet.join(ID, writer) if ID is not None else None
+		if robot is None:
+			print("Turning away robot", ID)
+			writer.close()
+			return
+		try:
+			await robot.runAsync(reader, writer, self.executor)
+		finally:
+			self.fleet.leave(robot, writer)
 
 	def terminate(self):
 		self.keepRunning = False
+		if self.scheduler is not None:
+			self.scheduler.terminate()
+		self.fleet.terminate()
+		for renderer in self.renderers:
+			renderer.terminate()
+		self.log.close()
+		print(self.gasses.report())
+		self.gasses.close()
 
 
 #############################
 # Create Base Station and Run#
 #############################
 parser = argparse.ArgumentParser()
-parser.add_argument("--NR", dest='numRob', type=int, help="Number of Robots to try to connect to", default=1)
+parser.add_argument("--NR", dest='numRob', type=int, help="Most robots connected at once, 0 for no limit", default=0)
 parser.add_argument("--IP", dest='ip', type=str, help="IP address of server", default="192.168.0.100") #
 parser.add_argument("--IN", dest='inputs', type=str, help="apriltag 0 vs encoder 1 dependent robot", default =0)
+parser.add_argument("--DUPLEX", dest='duplex', action='store_true', help="stream telemetry and commands both ways instead of taking turns (robots need --duplex too)")
+parser.add_argument("--ASYNC", dest='useAsync', action='store_true', help="serve every robot from one asyncio event loop instead of a thread each")
+parser.add_argument("--WORKERS", dest='workers', type=int, help="worker threads for planning and mapping in --ASYNC mode", default=2)
+parser.add_argument("--HZ", dest='hz', type=float, help="plan and send for the whole fleet at this rate instead of per robot (needs --DUPLEX, threaded mode)", default=0)
+parser.add_argument("--ARMS", dest='arms', type=str, help="gas sensor layout file, one distance(m),angle(deg) line per sensor", default=None)
+parser.add_argument("--FSYNC", dest='fsync', type=str, choices=RunLog.FSYNC_POLICIES, help="when the run log is forced to disk: never, after every chunk, or on close", default='close')
+parser.add_argument("--HOT", dest='hotRows', type=int, help="gas readings per robot to keep in memory, older ones go to a spill file, 0 keeps everything", default=0)
+parser.add_argument("--CAMERAS", dest='cameras', type=str, help="field camera file, one port,x(m),y(m),z(m),angle(deg) line per camera", default=None)
+parser.add_argument("--MAPFPS", dest='mapFps', type=float, help="write the gas map to a PNG this many times a second, 0 for never", default=0)
+parser.add_argument("--GIF", dest='gif', action='store_true', help="string the map frames into a GIF time-lapse on exit (needs --MAPFPS and Pillow)")
+parser.add_argument("--SHOWMAP", dest='showFps', type=float, help="show the gas map in a window redrawn this many times a second, 0 for no window", default=0)
+parser.add_argument("--PALETTE", dest='palette', type=str, choices=sorted(Colormap.PALETTES), help="map colours", default='viridis')
+parser.add_argument("--LOGCON", dest='logCon', action='store_true', help="space map colours by concentration ratio instead of difference")
+parser.add_argument("--AUTORANGE", dest='autoRange', action='store_true', help="colour the map from the 2nd to 98th percentile of the gas seen instead of 0-3000 ppm")
 args = parser.parse_args()
-base = Base(args.numRob, args.ip, args.inputs)
+if args.gif and args.mapFps <= 0:
+	parser.error("--GIF needs --MAPFPS")
+if args.hz > 0 and (not args.duplex or args.useAsync):
+	parser.error("--HZ needs --DUPLEX and the threaded server")
+arms = ArmGeometry.ArmGeometry.load(args.arms) if args.arms else None
+cameras = AprilTag.Camera.load(args.cameras) if args.cameras else None
+colormap = Colormap.Colormap(args.palette, low=1 if args.logCon else Colormap.Colormap.LOW, log=args.logCon,
+							 auto=(2, 98) if args.autoRange else None)
+base = Base(args.numRob, args.ip, args.inputs, args.duplex, args.hz, arms, args.fsync, args.hotRows, cameras, args.mapFps, args.gif, args.showFps, colormap)
 try:
-	base.run()
+	if args.useAsync:
+		base.runAsync(args.workers)
+	else:
+		base.run()
 except KeyboardInterrupt:
-	base.terminate()
-	sys.exit()
+	pass
+base.terminate()
+sys.exit()
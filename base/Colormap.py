@@ -0,0 +1,110 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# Colormap.py
+#
+# Gas concentration to colour
+# every palette is a 256 entry lookup table made once, so colouring a
+# whole grid is scaling it to 0-255 and one lookup. values outside the
+# range get the colour at its ends, nan gets the missing colour
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import numpy as np
+
+
+# evenly spaced stops along each palette, low to high
+PALETTES = {
+	# perceptually uniform, from matplotlib
+	'viridis': ['#440154', '#482475', '#3b528b', '#2c728e', '#21918c', '#28ae80', '#5ec962', '#addc30', '#fde725'],
+	'magma': ['#000004', '#1c1044', '#51127c', '#832681', '#b73779', '#e75263', '#fc8961', '#fec287', '#fcfdbf'],
+	'inferno': ['#000004', '#1f0c48', '#550f6d', '#88226a', '#ba3655', '#e35933', '#f98e09', '#f9cb35', '#fcffa4'],
+	'plasma': ['#0d0887', '#4c02a1', '#7e03a8', '#aa2395', '#cc4778', '#e56b5d', '#f89540', '#fdc527', '#f0f921'],
+	# the map's original green to red
+	'redgreen': ['#00ff00', '#ff0000'],
+}
+
+_luts = {}
+
+
+# 256 x 3 uint8 colours for a palette, straight lines between its stops
+def lut(palette):
+	table = _luts.get(palette)
+	if table is None:
+		stops = np.array([[int(stop[i:i + 2], 16) for i in (1, 3, 5)] for stop in PALETTES[palette]], float)
+		at = np.linspace(0, 1, len(stops))
+		points = np.linspace(0, 1, 256)
+		table = np.stack([np.interp(points, at, stops[:, c]) for c in range(3)], axis=1)
+		table = _luts[palette] = np.rint(table).astype(np.uint8)
+	return table
+
+
+class Colormap:
+	LOW = 0
+	HIGH = 3000  # original is 10000, changed for testing
+	MISSING = (0, 0, 0)
+
+	# low and high (ppm) get the two ends of the palette
+	# log spaces the colours by ratio instead of difference, low must be above 0
+	# auto is (low, high) percentiles of the values being coloured to use
+	# as the range instead, e.g. (2, 98), so the range follows the gas
+	def __init__(self, palette='viridis', low=LOW, high=HIGH, log=False, auto=None):
+		if palette not in PALETTES:
+			raise ValueError("palette must be one of %s" % (sorted(PALETTES),))
+		if log and low <= 0:
+			raise ValueError("a log colormap needs low above 0")
+		self.palette = palette
+		self.lut = lut(palette)
+		self.low = low
+		self.high = high
+		self.log = log
+		self.auto = auto
+
+	# (low, high) to colour values with
+	def range(self, values=None):
+		if self.auto is None or values is None:
+			return self.low, self.high
+		values = np.asarray(values, dtype=np.float64)
+		values = values[np.isfinite(values)]
+		if self.log:
+			values = values[values > 0]
+		if len(values) == 0:
+			return self.low, self.high
+		low, high = np.percentile(values, self.auto)
+		if high <= low:
+			high = low + (1 if not self.log else low)	# one value everywhere
+		return low, high
+
+	# LUT row, 0-255, of every value, clamped to the ends
+	# nan gets 0, rgb is the one that tells them apart
+	def index(self, values, low=None, high=None):
+		if low is None:
+			low, high = self.range(values)
+		values = np.asarray(values, dtype=np.float64)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			if self.log:
+				scaled = (np.log(values) - np.log(low)) / (np.log(high) - np.log(low))
+			else:
+				scaled = (values - low) / (high - low)
+		scaled = np.nan_to_num(scaled, nan=0)
+		return np.rint(np.clip(scaled, 0, 1) * 255).astype(np.uint8)
+
+	# ... x 3 uint8 colours of an array of values, missing where they're nan
+	def rgb(self, values, missing=MISSING):
+		values = np.asarray(values, dtype=np.float64)
+		low, high = self.range(values)
+		# nan looks up an extra row past the palette
+		index = np.where(np.isnan(values), len(self.lut), self.index(values, low, high).astype(np.intp))
+		return np.take(np.vstack([self.lut, np.array(missing, np.uint8)]), index, axis=0)
+
+	# '#rrggbb' for one value, with the fixed range
+	def colour(self, value):
+		r, g, b = self.lut[self.index(value, self.low, self.high)]
+		return '#%02x%02x%02x' % (r, g, b)
@@ -0,0 +1,89 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# Fleet.py
+#
+# Who's on the field right now
+# robots come and go as they connect and drop, a robot that comes back
+# with the same ID picks up right where it left off
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import threading
+
+import Robot
+import SampleStore
+import GasGrid
+
+
+class Fleet:
+	def __init__(self, maxRobots=0, duplex=False, scheduled=False, arms=None, log=None, store=None, grid=None):
+		self.maxRobots = maxRobots	# 0 for no limit
+		self.duplex = duplex
+		self.scheduled = scheduled
+		self.arms = arms	# ArmGeometry, None for Robot's default
+		self.log = log	# RunLogger every robot writes to, None for one each
+		self.lock = threading.Lock()
+
+		self.robots = {}	# ID -> Robot, connected
+		self.parked = {}	# ID -> Robot, dropped and waiting to come back
+
+		# gas readings from every robot in one place
+		self.gasses = store if store is not None else SampleStore.SampleStore()
+		# and as a running mean and variance per cell, what the map draws and planning can ask
+		self.grid = grid if grid is not None else GasGrid.GasGrid()
+
+	# register a robot that just connected
+	# returns its Robot, the old one if the ID has been here before,
+	# or None if the fleet is full
+	def join(self, id, conn):
+		with self.lock:
+			robot = self.robots.get(id)
+			if robot is None:
+				# coming back from the parked table takes a place like anyone new
+				if self.maxRobots and len(self.robots) >= self.maxRobots:
+					return None
+				robot = self.parked.pop(id, None)
+			if robot is None:
+				robot = Robot.Robot(id, conn, self.duplex, self.scheduled, self.gasses, self.arms, self.log, self.grid)
+			else:
+				# came back before we noticed it left, or after
+				# either way the new connection takes over
+				robot.reconnect(conn)
+			self.robots[id] = robot
+			print("Robot", id, "joined,", len(self.robots), "connected")
+			return robot
+
+	# take a robot out of the live table once its connection is done
+	# conn is the connection that ended, if the robot has already
+	# reconnected on a new one it stays
+	def leave(self, robot, conn):
+		with self.lock:
+			if robot.conn is not conn or self.robots.get(robot.id) is not robot:
+				return
+			del self.robots[robot.id]
+			self.parked[robot.id] = robot
+			print("Robot", robot.id, "left,", len(self.robots), "connected")
+
+	# connected robots
+	def live(self):
+		with self.lock:
+			return list(self.robots.values())
+
+	# ID -> RobotState for every connected robot
+	def snapshot(self):
+		return {robot.id: robot.snapshot() for robot in self.live()}
+
+	def __len__(self):
+		return len(self.robots)
+
+	def terminate(self):
+		for robot in self.live():
+			robot.terminate()
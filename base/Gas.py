@@ -14,7 +14,6 @@
 #Eric Fast
 #Stepthen Harnais
 
-import sympy
 import math
 import logging
 
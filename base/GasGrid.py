@@ -0,0 +1,136 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# GasGrid.py
+#
+# The gas field on a fixed grid
+# every cell keeps a running count, mean and variance of the readings that
+# landed in it (Welford), so the size only depends on the arena, not on
+# how long the run has gone
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import threading
+
+import numpy as np
+
+
+class GasGrid:
+	# cell is the side of a cell (m), extent the (x0, y0, x1, y1) it covers (m)
+	def __init__(self, cell=.05, extent=(-5, -5, 5, 5)):
+		self.cell = cell
+		self.x0, self.y0, x1, y1 = extent
+		self.nx = int(np.ceil((x1 - self.x0) / cell))
+		self.ny = int(np.ceil((y1 - self.y0) / cell))
+		self.count = np.zeros((self.ny, self.nx), np.int64)
+		self.mean = np.zeros((self.ny, self.nx))
+		self.m2 = np.zeros((self.ny, self.nx))	# sum of squared differences from the mean
+		self.outside = 0	# readings that fell off the grid
+		self.version = 0	# counts up with every update, lets drawing skip unchanged grids
+		self.lock = threading.Lock()	# every robot's thread adds readings
+
+	# (row, column) of the cell under x, y, None if it's off the grid
+	def cellOf(self, x, y):
+		ix = int((x - self.x0) // self.cell)
+		iy = int((y - self.y0) // self.cell)
+		if 0 <= ix < self.nx and 0 <= iy < self.ny:
+			return iy, ix
+		return None
+
+	# centre of a cell (m)
+	def centre(self, iy, ix):
+		return self.x0 + (ix + .5) * self.cell, self.y0 + (iy + .5) * self.cell
+
+	# one reading
+	def add(self, x, y, value):
+		cell = self.cellOf(x, y)
+		with self.lock:
+			if cell is None:
+				self.outside += 1
+				return
+			n = self.count[cell] + 1
+			delta = value - self.mean[cell]
+			self.count[cell] = n
+			self.mean[cell] += delta / n
+			self.m2[cell] += delta * (value - self.mean[cell])
+			self.version += 1
+
+	# many readings at once, x, y and values all the same length
+	# the batch's own per cell stats are merged into the grid's (Chan et al.)
+	# returns the flat indices of the cells that changed
+	def addBatch(self, x, y, values):
+		x = np.asarray(x, dtype=np.float64).ravel()
+		y = np.asarray(y, dtype=np.float64).ravel()
+		values = np.asarray(values, dtype=np.float64).ravel()
+		ix = np.floor((x - self.x0) / self.cell)
+		iy = np.floor((y - self.y0) / self.cell)
+		inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny) & ~np.isnan(values)
+		flat = (iy[inside] * self.nx + ix[inside]).astype(np.intp)
+		values = values[inside]
+
+		# stats of just this batch, per cell it touched
+		cells, which = np.unique(flat, return_inverse=True)
+		n = np.bincount(which)
+		batchMean = np.bincount(which, values) / n
+		spread = values - batchMean[which]
+		batchM2 = np.bincount(which, spread * spread)
+
+		with self.lock:
+			self.outside += len(x) - len(flat)
+			count = self.count.reshape(-1)
+			mean = self.mean.reshape(-1)
+			m2 = self.m2.reshape(-1)
+			total = count[cells] + n
+			delta = batchMean - mean[cells]
+			mean[cells] += delta * n / total
+			m2[cells] += batchM2 + delta * delta * count[cells] * n / total
+			count[cells] = total
+			self.version += 1
+		return cells
+
+	# variance of every cell, nan where there are fewer than two readings
+	def variance(self):
+		with self.lock:
+			count = self.count.copy()
+			m2 = self.m2.copy()
+		out = np.full(count.shape, np.nan)
+		many = count > 1
+		out[many] = m2[many] / (count[many] - 1)
+		return out
+
+	# mean of every cell, nan where nothing's been read, a copy
+	def means(self):
+		with self.lock:
+			out = self.mean.copy()
+			out[self.count == 0] = np.nan
+		return out
+
+	# (count, mean, variance) of the cell under x, y, None if it's off the grid
+	def at(self, x, y):
+		cell = self.cellOf(x, y)
+		if cell is None:
+			return None
+		with self.lock:
+			n, mean, m2 = self.count[cell], self.mean[cell], self.m2[cell]
+		return int(n), (mean if n else np.nan), (m2 / (n - 1) if n > 1 else np.nan)
+
+	# mean under each of the points, nan off the grid or where nothing's been read
+	def meanAt(self, x, y):
+		x = np.asarray(x, dtype=np.float64)
+		y = np.asarray(y, dtype=np.float64)
+		ix = np.floor((x - self.x0) / self.cell)
+		iy = np.floor((y - self.y0) / self.cell)
+		inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+		out = np.full(x.shape, np.nan)
+		iy, ix = iy[inside].astype(np.intp), ix[inside].astype(np.intp)
+		with self.lock:
+			seen = self.count[iy, ix] > 0
+			out[np.flatnonzero(inside)[seen]] = self.mean[iy[seen], ix[seen]]
+		return out
@@ -16,18 +16,32 @@
 # Stepthen Harnais
 
 import sys
+import time
+import tkinter
+import numpy as np
 import Gas
+import GasGrid
+import MapImage
+import Colormap
 
 sys.path.append('libs/')
-from libs.graphics import *
+try:
+	from libs.graphics import *
+except tkinter.TclError:
+	# no display, Map can't open a window but MapImage and MapWriter still work
+	GraphWin = None
 
 
 class Map:
-	MINCON = 0
-	MAXCON = 3000  # original is 10000, changed for testing
-	ROBOT = .35
-
-	def __init__(self, id, sizeX=600, sizeY=600, scale=100):
+	ROBOT = MapImage.MapImage.ROBOT
+
+	# grid is the GasGrid to draw, shared with the fleet if given
+	# image draws the whole grid as one picture every frame instead of a
+	# rectangle per cell, only the robot stays a canvas item
+	# colormap is the Colormap cells are drawn with
+	def __init__(self, id, sizeX=600, sizeY=600, scale=100, grid=None, image=False, colormap=None):
+		if GraphWin is None:
+			raise RuntimeError("no display for the map window, use MapWriter to draw to files")
 		self.win = GraphWin(("Robot"), sizeX, sizeY)
 
 		self.scale = scale
@@ -38,40 +52,70 @@ class Map:
 		self.centerX = sizeX / 2
 		self.centerY = sizeY / 2
 
-		self.gasses = []
+		# gas field by cell, one rectangle per cell that has had a reading
+		self.grid = grid if grid is not None else GasGrid.GasGrid()
+		self.cells = {}		# flat cell index -> Rectangle
+		self.drawn = -1		# grid version last drawn
+
+		self.colormap = colormap if colormap is not None else Colormap.Colormap()
+		# the same map as a picture, for image mode and savefile
+		self.picture = MapImage.MapImage(self.grid, sizeX, sizeY, scale, self.colormap)
+		self.image = None
+		if image:
+			self.image = Image(Point(self.centerX, self.centerY), sizeX, sizeY)
+			self.image.draw(self.win)
+		self.frames = 0
+		self.frameTime = 0	# s, spent drawing frames
 
 		self.robot = Circle(Point(self.sizeX * 2, self.sizeY * 2), int(Map.ROBOT * self.scale / 2))
+		self.robotAt = []	# (x, y) the robot was last drawn at
+		self.markers = {}	# ID -> Circle, with updateRobots
 
 		return
 
 	def addGas(self, gas):
-		# don't forget that the axis get rotated with the camera
-		con = gas.getCon()
-		newgas = [Circle(Point((self.centerX - (gas.getY() * self.scale)),
-							   (self.centerY - (gas.getX() * self.scale))), 1),
-				  con]
-		self.gasses.append(newgas)
-		newgas[0].draw(self.win)
-		val = self.getColor(newgas[1])
-		color = color_rgb(int(val), int(255 - val), int(0))
-		newgas[0].setFill(color)
-		newgas[0].setOutline(color)
+		self.grid.add(gas.getX(), gas.getY(), gas.getCon())
+		cell = self.grid.cellOf(gas.getX(), gas.getY())
+		if cell is not None and self.image is None:
+			self.drawCell(cell[0] * self.grid.nx + cell[1])
 		return
 
-	# convert concentration value to color based on the min and max Cons
-	# its just linear interpolation
-	def getColor(self, value):
-		spanCon = Map.MAXCON - Map.MINCON
-
-		valueScaled = float(value - Map.MINCON) / float(spanCon)
+	# many readings at once, x, y and con all the same length
+	def addGasBatch(self, x, y, con):
+		cells = self.grid.addBatch(x, y, con)
+		if self.image is None:
+			for flat in cells:
+				self.drawCell(flat)
+		return
 
-		# return scaled value
-		return 0 + (valueScaled * 255)
+	# colour one cell by its mean, making its rectangle the first time
+	def drawCell(self, flat):
+		grid = self.grid
+		iy, ix = divmod(int(flat), grid.nx)
+		rect = self.cells.get(flat)
+		if rect is None:
+			# don't forget that the axis get rotated with the camera
+			x0, y0 = grid.x0 + ix * grid.cell, grid.y0 + iy * grid.cell
+			x1, y1 = x0 + grid.cell, y0 + grid.cell
+			rect = Rectangle(Point(self.centerX - y1 * self.scale, self.centerY - x1 * self.scale),
+							 Point(self.centerX - y0 * self.scale, self.centerY - x0 * self.scale))
+			rect.draw(self.win)
+			self.cells[flat] = rect
+		color = self.colormap.colour(grid.mean[iy, ix])
+		rect.setFill(color)
+		rect.setOutline(color)
+
+	# convert concentration value to its place (0-255) along the colormap
+	# clamped to the ends outside the range
+	def getColor(self, value):
+		return int(self.colormap.index(value, self.colormap.low, self.colormap.high))
 
 	# takes in a robot
 	# puts robot on the map
 	# we made it fam!
 	def updateRobot(self, robot):
+		self.robotAt = [(robot.getX(), robot.getY())]
+		self.picture.addTrack(robot.getID(), robot.getX(), robot.getY())
 		self.robot.undraw()
 		self.robot = Circle(Point((self.centerX - (robot.getY() * self.scale)),
 								  (self.centerY - (robot.getX() * self.scale))),
@@ -80,17 +124,79 @@ class Map:
 		self.robot.draw(self.win)
 		return
 
+	# the whole fleet at once, positions is ID -> (x, y, ...)
+	def updateRobots(self, positions):
+		for marker in self.markers.values():
+			marker.undraw()
+		self.markers = {}
+		self.robotAt = []
+		for id, pos in positions.items():
+			x, y = pos[0], pos[1]
+			self.picture.addTrack(id, x, y)
+			marker = Circle(Point((self.centerX - (y * self.scale)),
+								  (self.centerY - (x * self.scale))),
+							int(Map.ROBOT * self.scale / 2))
+			marker.setFill("white")
+			marker.draw(self.win)
+			self.markers[id] = marker
+			self.robotAt.append((x, y))
+		return
+
 	# updates gas colors and draws them
+	# only cells that have had a reading, so it's as slow as the arena is big,
+	# not as the run is long
 	def updateGas(self):
-		for gas in self.gasses:
-			val = self.getColor(gas[1])
-			color = color_rgb(int(val), int(255 - val), int(0))
-			gas[0].setFill(color)
-			gas[0].setOutline(color)
-			self.win.update()
+		if self.grid.version == self.drawn:
+			return
+		self.drawn = self.grid.version
+		start = time.perf_counter()
+		if self.image is not None:
+			self.blit(self.picture.gas())
+		else:
+			for flat in np.flatnonzero(self.grid.count):
+				self.drawCell(flat)
+		self.win.update()
+		self.frameTime += time.perf_counter() - start
+		self.frames += 1
 		return
 
-	def savefile(self, filename, map):	#todo does this work
-		f = filename
-		s = Image(map)
-		s.save(f)
\ No newline at end of file
+	#############################
+	# Whole grid as one image    #
+	#############################
+
+	# put a sizeY x sizeX x 3 RGB picture on the window
+	def blit(self, pixels):
+		height, width = pixels.shape[:2]
+		ppm = b'P6 %d %d 255\n' % (width, height) + pixels.tobytes()
+		self.image.img.configure(data=ppm, format='PPM')
+
+	# ms per frame drawn so far
+	def report(self):
+		return "%d frames, %.2f ms per frame" % (self.frames, 1000 * self.frameTime / max(self.frames, 1))
+
+	# the map with the robot's track as a PNG
+	def savefile(self, filename):
+		with open(filename, 'wb') as f:
+			f.write(MapImage.png(self.picture.frame(self.robotAt)))
+
+# frame time as the readings pile up, needs a display
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description="time drawing the gas map")
+	parser.add_argument("--SAMPLES", dest='samples', type=int, help="readings to end up with", default=1000000)
+	parser.add_argument("--CELLS", dest='cells', action='store_true', help="draw a rectangle per cell instead of one image")
+	args = parser.parse_args()
+	map = Map(0, image=not args.cells)
+	rng = np.random.default_rng(0)
+	total = 0
+	step = 1000
+	while total < args.samples:
+		x, y = rng.normal(0, 1, (2, step))
+		map.addGasBatch(x, y, 1500 + 500 * np.exp(-(x * x + y * y)))
+		total += step
+		map.frames = map.frameTime = 0
+		for i in range(10):
+			map.drawn = -1
+			map.updateGas()
+		print(total, "readings,", map.report())
+		step *= 10
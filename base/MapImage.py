@@ -0,0 +1,120 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# MapImage.py
+#
+# The gas map as an RGB picture, no window needed
+# every cell's mean goes through a Colormap and every pixel looks up
+# the cell under it, so a frame takes as long with a million
+# readings as with ten. robot tracks and markers are painted on top
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import zlib
+import struct
+
+import numpy as np
+
+import Colormap
+
+
+class MapImage:
+	ROBOT = .35
+	BACKGROUND = (0, 0, 0)	# cells nothing's been read in
+	TRACK = (128, 128, 255)
+	MARKER = (255, 255, 255)
+
+	# same layout as Map, every pixel is a cm at scale 100 and the
+	# field's x axis points up the picture
+	def __init__(self, grid, sizeX=600, sizeY=600, scale=100, colormap=None):
+		self.grid = grid
+		self.colormap = colormap if colormap is not None else Colormap.Colormap()
+		self.sizeX = sizeX
+		self.sizeY = sizeY
+		self.scale = scale
+		self.centerX = sizeX / 2
+		self.centerY = sizeY / 2
+		self.mapPixels()
+
+		# where every robot has been, painted a segment at a time
+		self.tracks = np.zeros((sizeY, sizeX), bool)
+		self.last = {}	# ID -> pixel (column, row) the track got to
+
+		# pixels a marker covers around its centre
+		radius = int(MapImage.ROBOT * scale / 2)
+		dy, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+		inside = dx * dx + dy * dy <= radius * radius
+		self.disk = dx[inside], dy[inside]
+
+	# (column, row) of the pixel under x, y (m)
+	def toPixel(self, x, y):
+		# don't forget that the axis get rotated with the camera
+		return self.centerX - (y * self.scale), self.centerY - (x * self.scale)
+
+	# grid cell under the middle of every pixel, worked out once
+	# a pixel off the grid gets the extra background row/column
+	def mapPixels(self):
+		grid = self.grid
+		y = (self.centerX - (np.arange(self.sizeX) + .5)) / self.scale
+		x = (self.centerY - (np.arange(self.sizeY) + .5)) / self.scale
+		iy = np.floor((y - grid.y0) / grid.cell).astype(np.intp)
+		ix = np.floor((x - grid.x0) / grid.cell).astype(np.intp)
+		iy[(iy < 0) | (iy >= grid.ny)] = grid.ny
+		ix[(ix < 0) | (ix >= grid.nx)] = grid.nx
+		# flat index into the (ny + 1) x (nx + 1) colours of the cell under each pixel
+		self.pixelCells = iy[None, :] * (grid.nx + 1) + ix[:, None]
+
+	# the grid as a sizeY x sizeX x 3 RGB picture
+	def gas(self):
+		grid = self.grid
+		colours = np.empty((grid.ny + 1, grid.nx + 1, 3), np.uint8)
+		colours[-1, :] = colours[:, -1] = MapImage.BACKGROUND
+		colours[:grid.ny, :grid.nx] = self.colormap.rgb(grid.means(), MapImage.BACKGROUND)
+		return np.take(colours.reshape(-1, 3), self.pixelCells, axis=0)
+
+	# carry a robot's track on to x, y (m)
+	# only the new segment is drawn, so long runs don't cost more
+	def addTrack(self, id, x, y):
+		col, row = self.toPixel(x, y)
+		lastCol, lastRow = self.last.get(id, (col, row))
+		self.last[id] = (col, row)
+		steps = int(max(abs(col - lastCol), abs(row - lastRow))) + 1
+		cols = np.rint(np.linspace(lastCol, col, steps)).astype(np.intp)
+		rows = np.rint(np.linspace(lastRow, row, steps)).astype(np.intp)
+		inside = (cols >= 0) & (cols < self.sizeX) & (rows >= 0) & (rows < self.sizeY)
+		self.tracks[rows[inside], cols[inside]] = True
+
+	# the gas picture with tracks, and a marker for each (x, y) in robots
+	def frame(self, robots=()):
+		pixels = self.gas()
+		pixels[self.tracks] = MapImage.TRACK
+		dx, dy = self.disk
+		for x, y in robots:
+			col, row = self.toPixel(x, y)
+			cols = int(round(col)) + dx
+			rows = int(round(row)) + dy
+			inside = (cols >= 0) & (cols < self.sizeX) & (rows >= 0) & (rows < self.sizeY)
+			pixels[rows[inside], cols[inside]] = MapImage.MARKER
+		return pixels
+
+
+# an RGB picture (height x width x 3, uint8) as a PNG file's bytes
+def png(pixels, level=3):
+	height, width = pixels.shape[:2]
+
+	def chunk(kind, data):
+		return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+	# every row starts with its filter type, 0 for none
+	rows = np.zeros((height, width * 3 + 1), np.uint8)
+	rows[:, 1:] = pixels.reshape(height, width * 3)
+	header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)	# 8 bit RGB
+	return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+			+ chunk(b'IDAT', zlib.compress(rows.tobytes(), level)) + chunk(b'IEND', b''))
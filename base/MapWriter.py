@@ -0,0 +1,77 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# MapWriter.py
+#
+# The gas map drawn to files instead of a window
+# a Renderer that writes the fleet's newest state out as numbered PNG
+# frames a few times a second, and at the end can string them together
+# into a GIF time-lapse. no display needed
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import os
+
+import MapImage
+import Renderer
+
+
+class MapWriter(Renderer.Renderer):
+	# most frames a time-lapse is made from, picked evenly through the run
+	GIF_FRAMES = 300
+	GIF_FPS = 10
+
+	def __init__(self, fleet, directory, fps=1.0, gif=False, sizeX=600, sizeY=600, scale=100, colormap=None):
+		Renderer.Renderer.__init__(self, fleet, fps, "map files")
+		self.directory = directory	# frames go in as 000000.png, 000001.png, ...
+		os.makedirs(directory, exist_ok=True)
+		self.gif = gif	# make <directory>.gif from the frames at the end
+		self.picture = MapImage.MapImage(fleet.grid, sizeX, sizeY, scale, colormap)
+		self.files = []
+
+	def draw(self, states):
+		robots = []
+		for id, state in states.items():
+			if not state.lastTelemetry:
+				continue	# hasn't said where it is yet
+			x, y = state.curpos[0], state.curpos[1]
+			self.picture.addTrack(id, x, y)
+			robots.append((x, y))
+		filename = os.path.join(self.directory, "%06d.png" % len(self.files))
+		with open(filename, 'wb') as f:
+			f.write(MapImage.png(self.picture.frame(robots)))
+		self.files.append(filename)
+
+	# last frame, then the time-lapse
+	def close(self):
+		self.frame()
+		if self.gif:
+			filename = self.writeGif()
+			if filename:
+				print("time-lapse in", filename)
+
+	# needs Pillow, without it the PNG frames are all there is
+	def writeGif(self):
+		try:
+			from PIL import Image
+		except ImportError:
+			print("no Pillow for the time-lapse, frames are in", self.directory)
+			return None
+		if not self.files:
+			return None
+		step = -(-len(self.files) // MapWriter.GIF_FRAMES)
+		frames = [Image.open(name).convert('P', palette=Image.ADAPTIVE) for name in self.files[::step]]
+		filename = os.path.normpath(self.directory) + ".gif"
+		frames[0].save(filename, save_all=True, append_images=frames[1:],
+					   duration=1000 // MapWriter.GIF_FPS, loop=0)
+		return filename
+
+	def report(self):
+		return Renderer.Renderer.report(self) + ", in " + self.directory
@@ -0,0 +1,147 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# Renderer.py
+#
+# Drawing the map off the control path
+# a renderer has a thread of its own that wakes up at a fixed frame rate,
+# takes the fleet's newest snapshots and the gas grid and draws them.
+# robots never wait on it, if a frame runs long the ones it missed are
+# dropped, and every update since the last frame is drawn as one
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import time
+import threading
+
+
+class Renderer:
+	def __init__(self, fleet, fps=10, name="map"):
+		self.fleet = fleet
+		self.period = 1.0 / fps
+		self.name = name
+		self.shown = None	# grid version and ID -> seq the newest frame shows
+		self.stopped = threading.Event()
+
+		# counters
+		self.frames = 0
+		self.skipped = 0	# frames that came due while one was still being drawn
+		self.coalesced = 0	# updates that went into a frame along with another one
+		self.unchanged = 0	# frames not drawn, nothing had moved
+		self.frameTime = 0	# s, spent drawing
+
+	# called on the render thread, before the first frame and after the last
+	def open(self):
+		pass
+
+	def close(self):
+		pass
+
+	# draw a frame, states is ID -> RobotState for every connected robot
+	def draw(self, states):
+		raise NotImplementedError
+
+	# once a frame whether there was anything to draw or not
+	def idle(self):
+		pass
+
+	# grid updates and robot updates since the newest frame
+	def updates(self, states):
+		version = self.fleet.grid.version
+		seqs = {id: state.seq for id, state in states.items()}
+		if self.shown is None:
+			count = 1
+		else:
+			lastVersion, lastSeqs = self.shown
+			count = version - lastVersion + sum(seq - lastSeqs.get(id, 0) for id, seq in seqs.items())
+			if seqs.keys() != lastSeqs.keys():
+				count = max(count, 1)	# someone joined or left
+		self.shown = (version, seqs)
+		return count
+
+	# draw the newest state if it's changed, True if a frame was drawn
+	def frame(self):
+		states = self.fleet.snapshot()
+		updates = self.updates(states)
+		if updates == 0:
+			self.unchanged += 1
+			return False
+		start = time.perf_counter()
+		self.draw(states)
+		self.frameTime += time.perf_counter() - start
+		self.frames += 1
+		self.coalesced += updates - 1
+		return True
+
+	def run(self):
+		try:
+			self.open()
+		except RuntimeError as error:
+			print(self.name, "not started:", error)
+			return
+		try:
+			nextFrame = time.perf_counter()
+			while not self.stopped.wait(max(0, nextFrame - time.perf_counter())):
+				self.frame()
+				self.idle()
+
+				nextFrame += self.period
+				now = time.perf_counter()
+				if now > nextFrame:
+					# ran long, start the next one now and drop the ones we missed
+					missed = int((now - nextFrame) / self.period)
+					self.skipped += missed
+					nextFrame += missed * self.period
+		finally:
+			self.close()
+
+	def report(self):
+		return "%s: %d frames, %d skipped, %d coalesced, %d unchanged, %.2f ms per frame" % (
+			self.name, self.frames, self.skipped, self.coalesced, self.unchanged,
+			1000 * self.frameTime / max(self.frames, 1))
+
+	def start(self):
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		return self
+
+	def terminate(self):
+		self.stopped.set()
+		self.thread.join()
+		print(self.report())
+
+
+# the gas map in a window
+class MapWindow(Renderer):
+	def __init__(self, fleet, fps=10, sizeX=600, sizeY=600, scale=100, colormap=None):
+		Renderer.__init__(self, fleet, fps, "map window")
+		self.sizeX = sizeX
+		self.sizeY = sizeY
+		self.scale = scale
+		self.colormap = colormap
+		self.map = None
+
+	# the graphics library starts Tk when it's first imported, importing
+	# Map here keeps every Tk call on this thread
+	def open(self):
+		import Map
+		self.map = Map.Map("Fleet", self.sizeX, self.sizeY, self.scale, self.fleet.grid, image=True, colormap=self.colormap)
+
+	def draw(self, states):
+		self.map.updateRobots({id: state.curpos for id, state in states.items() if state.lastTelemetry})
+		self.map.updateGas()
+
+	# keeps the window responding between frames
+	def idle(self):
+		self.map.win.update()
+
+	def close(self):
+		if self.map is not None:
+			self.map.win.close()
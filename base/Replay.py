@@ -0,0 +1,295 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# Replay.py
+#
+# Plays a recorded run back into the base
+# every robot in the run log is impersonated with its original timing,
+# sped up or slowed down, either over the real protocol to a running
+# Base.py or straight into a Fleet in this process. Tag poses go into
+# the AprilTag server (or AprilTag.poses) along with the telemetry
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import sys
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+import RunLog
+
+sys.path.append('libs/')
+from libs.custom_libs import encoding_TCP as encode
+
+
+class Replay:
+	# longest (s) a duplex replay waits for the base's first answer, it warms up for 10
+	# and for it to answer the last records
+	FIRST = 15
+	DRAIN = 2
+
+	def __init__(self, filename, speed=1.0, robots=None, t0=None, t1=None):
+		self.speed = speed	# 2 for twice as fast as recorded, 0 for as fast as possible
+		reader = RunLog.RunReader(filename)
+		if robots is None:
+			robots = reader.robots()
+		self.runs = {}	# ID -> that robot's records in time order
+		for id in robots:
+			run = reader.query(int(id), t0, t1)
+			# nothing to replay from a record without gas (converted 'predicted position' files)
+			run = run[~np.isnan(run['gas']).all(axis=1)]
+			if len(run):
+				self.runs[int(id)] = run[np.argsort(run['t'], kind='stable')]
+		if not self.runs:
+			raise ValueError("nothing to replay in %s" % filename)
+		self.start = min(run['t'][0] for run in self.runs.values())
+
+		# counters
+		self.played = 0
+		self.replies = 0
+		self.lag = []	# s, how far behind the recorded timing each record went out
+		self.steps = []	# s, base side time per record when replaying in process
+
+	def __len__(self):
+		return sum(len(run) for run in self.runs.values())
+
+	# wall clock time a record logged at t goes out, for a replay started at clock0
+	def due(self, t, clock0):
+		if self.speed <= 0:
+			return clock0
+		return clock0 + (t - self.start) / self.speed
+
+	# the [curpos, gas] message the robot sent
+	@staticmethod
+	def telemetry(record):
+		gas = [float(g) for g in record['gas'] if not np.isnan(g)]
+		return [[float(record['kal_x']), float(record['kal_y']), float(record['kal_theta'])], gas]
+
+	# tag pose as the field camera reports it, x y z yaw pitch roll
+	# None if the log has no tag pose
+	@staticmethod
+	def tag(record):
+		if np.isnan(record['x']):
+			return None
+		return [float(record['x']), float(record['y']), 0.0, 0.0, float(record['theta']), 0.0]
+
+	# sleep until a record logged at t is due, and note how late it is
+	def wait(self, t, clock0):
+		if self.speed <= 0:
+			return
+		delay = self.due(t, clock0) - time.time()
+		if delay > 0:
+			time.sleep(delay)
+		self.lag.append(max(0, -delay))
+
+	async def waitAsync(self, t, clock0):
+		if self.speed <= 0:
+			return
+		delay = self.due(t, clock0) - time.time()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		self.lag.append(max(0, -delay))
+
+	#############################
+	# In process                 #
+	#############################
+
+	# every record goes through a Fleet's Robots the way the lockstep loop
+	# would handle it, no sockets involved, so the same log always ends up
+	# in the same gas readings and commands
+	# replayed control loops are logged to out
+	def runInProcess(self, out=None, arms=None):
+		import AprilTag
+		import Fleet
+
+		log = RunLog.RunLogger(out if out else "replay - %s.plog" % time.time())
+		fleet = Fleet.Fleet(scheduled=True, arms=arms, log=log)
+		records = np.concatenate(list(self.runs.values()))
+		records = records[np.argsort(records['t'], kind='stable')]
+
+		robots = {}
+		clock0 = time.time()
+		for record in records:
+			self.wait(record['t'], clock0)
+			id = int(record['robot_id'])
+			robot = robots.get(id)
+			if robot is None:
+				robot = robots[id] = fleet.join(id, None)
+			tag = Replay.tag(record)
+			if tag is not None:
+				AprilTag.poses.update(id, tag, receiveTime=float(record['t']))
+
+			start = time.perf_counter()
+			if id in AprilTag.poses:
+				robot.aprilTag()
+			robot.recieveTelemetry(Replay.telemetry(record), float(record['t']))
+			if id in AprilTag.poses:
+				robot.plan()
+			robot.fileWrite(float(record['t']))
+			self.steps.append(time.perf_counter() - start)
+			self.played += 1
+		log.close()
+		return fleet
+
+	#############################
+	# Over the network           #
+	#############################
+
+	# every robot gets its own connection to the base, tag poses share one
+	# connection to the AprilTag server just like the field camera
+	async def runNetwork(self, ip, port=5732, duplex=False, tags=True, tagip="127.0.0.1", tagport=9999):
+		tagWriter = None
+		if tags:
+			reader, tagWriter = await asyncio.open_connection(tagip, tagport)
+		try:
+			await asyncio.gather(*(self.replayRobot(id, run, ip, port, duplex, tagWriter)
+								   for id, run in self.runs.items()))
+		finally:
+			if tagWriter is not None:
+				tagWriter.close()
+
+	async def replayRobot(self, id, run, ip, port, duplex, tagWriter):
+		reader, writer = await asyncio.open_connection(ip, port)
+		try:
+			await encode.sendPacketAsync(writer, id)
+			if duplex:
+				await self.replayDuplex(id, run, reader, writer, tagWriter)
+			else:
+				await self.replayLockstep(id, run, reader, writer, tagWriter)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			print("Robot", id, "dropped by the base")
+		finally:
+			writer.close()
+
+	async def sendTag(self, id, record, tagWriter):
+		tag = Replay.tag(record)
+		if tagWriter is None or tag is None:
+			return
+		payload = ("%d,%f,%f,%f,%f,%f,%f" % tuple([id] + tag)).encode()
+		tagWriter.write(b"%d\n" % len(payload) + payload)
+		await tagWriter.drain()
+
+	# the robot's clock starts once the base has answered its first message,
+	# a fresh base spends its first 10 s warming up
+	def startClock(self, run):
+		return time.time() - (self.due(run['t'][0], 0) if self.speed > 0 else 0)
+
+	async def replayLockstep(self, id, run, reader, writer, tagWriter):
+		clock0 = None
+		for record in run:
+			if clock0 is not None:
+				await self.waitAsync(record['t'], clock0)
+			await self.sendTag(id, record, tagWriter)
+			await encode.sendPacketAsync(writer, Replay.telemetry(record), encode.MSG_TELEMETRY)
+			self.played += 1
+			rcv = await encode.recievePacketAsync(reader)
+			self.replies += 1
+			if rcv == "out":
+				await encode.sendPacketAsync(writer, "out")
+				return
+			if clock0 is None:
+				clock0 = self.startClock(run)
+
+	async def replayDuplex(self, id, run, reader, writer, tagWriter):
+		state = {'ack': 0, 'acked': 0, 'sent': 0, 'out': False}
+		answered = asyncio.Event()
+
+		async def recieve():
+			while True:
+				frame = await encode.recieveFrameAsync(reader)
+				self.replies += 1
+				state['ack'] = frame.seq
+				state['acked'] = max(state['acked'], frame.ack)
+				answered.set()
+				if frame.msg == "out":
+					state['out'] = True
+					return
+
+		# True once the base has sent something new, False if it's gone or timeout (s) ran out
+		async def answer(timeout=None):
+			answered.clear()
+			waiting = asyncio.ensure_future(answered.wait())
+			await asyncio.wait([recieving, waiting], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+			waiting.cancel()
+			return answered.is_set()
+
+		recieving = asyncio.ensure_future(recieve())
+		clock0 = None
+		try:
+			for seq, record in enumerate(run, 1):
+				if state['out']:
+					break
+				if clock0 is not None:
+					await self.waitAsync(record['t'], clock0)
+				await self.sendTag(id, record, tagWriter)
+				writer.write(encode.makePacket(Replay.telemetry(record), encode.MSG_TELEMETRY, seq=seq, ack=state['ack']))
+				await writer.drain()
+				state['sent'] = seq
+				self.played += 1
+				if clock0 is None:
+					# a base with no tag pose for us never answers, go on without
+					await answer(Replay.FIRST)
+					clock0 = self.startClock(run)
+			if state['out']:
+				writer.write(encode.makePacket("out", seq=len(run) + 1, ack=state['ack']))
+				await writer.drain()
+			else:
+				# answers to the last records are still on their way
+				end = time.time() + Replay.DRAIN
+				while state['acked'] < state['sent'] and await answer(end - time.time()):
+					pass
+		finally:
+			recieving.cancel()
+
+	def report(self, elapsed):
+		line = "replayed %d records from %d robots in %.2f s (%.0f records/s), %d replies" % (
+			self.played, len(self.runs), elapsed, self.played / max(elapsed, 1e-9), self.replies)
+		if self.lag:
+			lag = np.array(self.lag) * 1000
+			line += " | lag ms p50 %.2f p99 %.2f max %.2f" % (np.percentile(lag, 50), np.percentile(lag, 99), lag.max())
+		if self.steps:
+			steps = np.array(self.steps) * 1000
+			line += " | step ms p50 %.3f p99 %.3f" % (np.percentile(steps, 50), np.percentile(steps, 99))
+		return line
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="play a recorded run back into the base")
+	parser.add_argument("filename", help="run log to replay")
+	parser.add_argument("--SPEED", dest='speed', type=float, help="times real time, 0 for as fast as possible", default=1.0)
+	parser.add_argument("--ROBOTS", dest='robots', type=str, help="comma separated robot IDs to replay, default all of them", default=None)
+	parser.add_argument("--T0", dest='t0', type=float, help="replay from this (logged) time", default=None)
+	parser.add_argument("--T1", dest='t1', type=float, help="replay up to this (logged) time", default=None)
+	parser.add_argument("--INPROCESS", dest='inprocess', action='store_true', help="drive a Fleet in this process instead of connecting to a base")
+	parser.add_argument("--OUT", dest='out', type=str, help="run log for the replayed loops with --INPROCESS", default=None)
+	parser.add_argument("--ARMS", dest='arms', type=str, help="gas sensor layout file with --INPROCESS", default=None)
+	parser.add_argument("--IP", dest='ip', type=str, help="IP address of the base", default="127.0.0.1")
+	parser.add_argument("--PORT", dest='port', type=int, help="base port", default=5732)
+	parser.add_argument("--DUPLEX", dest='duplex', action='store_true', help="stream like a --duplex robot (base needs --DUPLEX)")
+	parser.add_argument("--NOTAGS", dest='notags', action='store_true', help="don't send tag poses to the AprilTag server")
+	parser.add_argument("--TAGPORT", dest='tagport', type=int, help="AprilTag server port (only listens on localhost)", default=9999)
+	args = parser.parse_args()
+
+	robots = [int(id) for id in args.robots.split(',')] if args.robots else None
+	replay = Replay(args.filename, args.speed, robots, args.t0, args.t1)
+	print("replaying", len(replay), "records from robots", sorted(replay.runs))
+	start = time.time()
+	try:
+		if args.inprocess:
+			import ArmGeometry
+			arms = ArmGeometry.ArmGeometry.load(args.arms) if args.arms else None
+			replay.runInProcess(args.out, arms)
+		else:
+			asyncio.run(replay.runNetwork(args.ip, args.port, args.duplex, not args.notags, tagport=args.tagport))
+	except KeyboardInterrupt:
+		pass
+	print(replay.report(time.time() - start))
@@ -20,94 +20,193 @@ import sys
 import pickle
 import threading
 import math
+import numpy as np
 import AprilTag
 import time
+import asyncio
+import collections
 
-import Gas
-import Map
+import SampleStore
+import GasGrid
+import ArmGeometry
+import RunLog
+import TagPoseStore
 
 sys.path.append('libs/')
 from libs.custom_libs import encoding_TCP as encode
 
 
+# what a robot looked like at one moment, never changed once made
+# readers on other threads take Robot.snapshot() instead of poking at the
+# fields the comm thread is busy changing
+RobotState = collections.namedtuple('RobotState', [
+	'id',
+	'seq',				# counts up with every state published
+	'published',		# s, when this state was made
+	'lastTelemetry',	# s, when the newest reading came in, 0 for never
+	'curpos',			# (x, y, theta) from the tags
+	'curposKal',		# (x, y, theta) the robot thinks it's at
+	'curgas',			# newest reading from every sensor
+	'desired',			# newest command
+])
+
+
 class Robot:
 	# max robot speed
 	SPEED = 38
 	# arm length
 	ARM_D = .25
+	# default sensor layout, four arms at right angles
+	ARMS = ArmGeometry.ArmGeometry.evenlySpaced(4, ARM_D)
+	# longest the duplex loop waits for fresh telemetry before planning anyway
+	DUPLEX_WAIT = .05
 
-	def __init__(self, id, conn):
+	def __init__(self, id, conn, duplex=False, scheduled=False, store=None, arms=None, log=None, grid=None):
 		self.id = id
 		self.index = 0
 		self.keepRunning = True
+		self.duplex = duplex
+		# planning and sending is done for the whole fleet by the base's Scheduler
+		self.scheduled = scheduled
+		self.link = None
+		self.seq = 0	# last seq sent on an asyncio duplex connection
+		self.ack = 0	# newest seq recieved on an asyncio duplex connection
 
 		# position initialization
 		self.curpos = [0, 0, 0]
 		self.desired = [0, 0, 0, 0, 0, 0]
 
 		self.curgas = []
-		self.gasses = []
+		# every gas reading, shared with the rest of the fleet if we're part of one
+		self.gasses = store if store is not None else SampleStore.SampleStore()
+		# running mean and variance of the readings by cell, shared the same way
+		self.grid = grid if grid is not None else GasGrid.GasGrid()
+		self.arms = arms if arms is not None else Robot.ARMS
+		self.lastTelemetry = 0	# when the newest reading came in, 0 for never
 		self.curposAT = [0,0,0]
 		self.curangAT = [0,0,0]
+		self.tagTime = 0	# when the camera pose in curposAT came in, 0 for never
+		self.clockOffset = np.inf	# s, our clock minus the robot's, from batch timestamps
 
 		self.conn = conn
+		self.connections = 1
 
-		#self.map = Map.Map(id)
-		filetime = time.time()
-		self.filename = "Kalman Filter - %s.csv" %filetime
-		self.file = open(self.filename, "w")
-		self.file.write("Kalman Filter: x -m,y -m,theta -rad,time -s , apriltag\n")
-		print(self.filename)
-		print("file should be made")
+		# newest published state, swapped whole so readers never need a lock
+		# publishers (comm thread, planner) take turns so neither loses the other's update
+		self.publishLock = threading.Lock()
+		self.state = RobotState(id, 0, time.time(), 0, (0, 0, 0), (0, 0, 0), (), tuple(self.desired))
 
-	def comm(self):
+		# binary run log, shared with the rest of the fleet if we're part of one
+		if log is None:
+			log = RunLog.RunLogger("run - %s - %s.plog" % (id, time.time()))
+			print(log.filename)
+		self.log = log
+
+	# conn is the connection run() started with, not self.conn, which a
+	# reconnect can swap out from under it
+	def comm(self, conn):
 
 		if self.keepRunning:
 			# recieve posn
-			[self.curposKal, self.curgas] = encode.recievePacket(sock=self.conn)
+			msg = encode.recievePacket(sock=conn)
+			if msg is None:
+				raise ConnectionError("robot %s dropped" % self.id)
+			self.recieveTelemetry(msg)
 
 			# print x,y,theta,velocity
 			print("robot thinks position",self.curposKal)
-			self.curpos = [self.curposAT[0], self.curposAT[1], self.curangAT[1]]
 			print("robot actual position", self.curpos)
 			print(self.curgas)
-			self.addGas()
 
 			# send desired velocities
 			print(self.desired,self.index)
-			self.desired[2] = self.index
-			self.desired[3] = self.curposAT[0]
-			self.desired[4] = self.curposAT[1]
-			self.desired[5] = self.curangAT[0]
+			self.packDesired()
 
-			encode.sendPacket(sock=self.conn, message=self.desired)
+			encode.sendPacket(sock=conn, message=encode.command(self.desired), msgtype=encode.MSG_COMMAND)
 			print("desired v sent", self.desired)
 		else:
 			# send out packet
-			encode.sendPacket(sock=self.conn, message="out")
+			encode.sendPacket(sock=conn, message="out")
 			# wait for confirmation of reception
-			rcv = encode.recievePacket(sock=self.conn)
+			rcv = encode.recievePacket(sock=conn)
 			# Clean up the connection
 			print("Closing Connection")
-			self.conn.close()
+			conn.close()
+
+	# takes the robot's [curpos, gas] message
+	# t is when it came in, now unless it's being replayed
+	def recieveTelemetry(self, msg, t=None):
+		[self.curposKal, self.curgas] = msg
+		self.lastTelemetry = time.time() if t is None else t
+		# where the camera had us when the reading came in
+		self.curpos = self.tagPoses([self.lastTelemetry])[0].tolist()
+		self.publishTelemetry()
+		self.addGas(self.lastTelemetry)
+
+	# takes a batch of (timestamp, pose, gas) rows from a batching robot
+	# every row goes in as a gas reading, the newest row becomes the current state
+	def recieveSamples(self, batch):
+		rows = np.frombuffer(batch.values, dtype=np.float64).reshape(-1, encode.SAMPLE_FIELDS)
+		timestamp, self.curposKal, self.curgas = batch.last()
+		self.lastTelemetry = time.time()
+		# rows are stamped with the robot's clock, the smallest gap between
+		# that and ours is the best guess at the offset (least network delay)
+		self.clockOffset = min(self.clockOffset, self.lastTelemetry - timestamp)
+		times = rows[:, 0] + self.clockOffset
+		poses = self.tagPoses(times)
+		self.curpos = poses[-1].tolist()
+		self.addGasBatch(times, poses, rows[:, 4:])
+		self.publishTelemetry()
+
+	# duplex link callback, runs on the link's reader thread
+	def onMessage(self, msg):
+		if isinstance(msg, encode.SampleBatch):
+			self.recieveSamples(msg)
+		elif msg != "out":
+			self.recieveTelemetry(msg)
+
+	# fill in what the robot gets along with the velocities
+	def packDesired(self):
+		self.desired[2] = self.index
+		self.desired[3] = self.curposAT[0]
+		self.desired[4] = self.curposAT[1]
+		self.desired[5] = self.curangAT[0]
+		self.publish(desired=tuple(self.desired))
+
+	# swap in a new state with the given fields changed
+	def publish(self, **changes):
+		with self.publishLock:
+			state = self.state
+			self.state = state._replace(seq=state.seq + 1, published=time.time(), **changes)
+
+	def publishTelemetry(self):
+		self.publish(lastTelemetry=self.lastTelemetry, curpos=tuple(self.curpos),
+					 curposKal=tuple(self.curposKal), curgas=tuple(self.curgas))
+
+	# newest published RobotState, safe from any thread
+	def snapshot(self):
+		return self.state
 
 	# adds gas to list of gasses and to the map
-	def addGas(self):	#TODO check how this is working
-		i = 0
-		for concentration in self.curgas:
-			x = (self.curpos[0] + Robot.ARM_D * math.cos(self.curpos[2] + ((math.pi / 2) * i)))
-			y = (self.curpos[1] + Robot.ARM_D * math.sin(self.curpos[2] + ((math.pi / 2) * i)))
-			gas = Gas.Gas(x, y, concentration)
-			self.gasses.append(gas)
-			#self.map.addGas(gas)
-			i = i + 1
+	# t is when the reading was taken
+	def addGas(self, t):	#TODO check how this is working
+		self.addGasBatch([t], [self.curpos], [self.curgas])
+
+	# many readings at once, each sensor placed at the end of its arm
+	# t is N long, poses N x 3, gas N x sensors
+	def addGasBatch(self, t, poses, gas):
+		t, x, y, con, sensor = self.arms.samples(t, poses, gas)
+		self.gasses.append(t, x, y, con, self.id, sensor)
+		self.grid.addBatch(x, y, con)
 
 	# determine highest of the gas concentrations
 	# and change desired to that direction
-	def findV(self):	# todo change back for proper pathing
-		self.index = self.curgas.index(max(self.curgas))
-		self.desired[0] = Robot.SPEED * math.cos(((math.pi / 2) * self.index) + self.curpos[2])
-		self.desired[1] = Robot.SPEED * math.sin(((math.pi / 2) * self.index) + self.curpos[2])
+	# state is the RobotState to plan on, so gas and heading are from the same reading
+	def findV(self, state):	# todo change back for proper pathing
+		curgas = list(state.curgas)
+		self.index = curgas.index(max(curgas))
+		self.desired[0] = Robot.SPEED * math.cos(self.arms.angle[self.index] + state.curpos[2])
+		self.desired[1] = Robot.SPEED * math.sin(self.arms.angle[self.index] + state.curpos[2])
 		#
 		# self.curtime = time.time()
 		#
@@ -121,39 +220,231 @@ class Robot:
 		# 	self.desired[0] = 0
 		# 	self.desired[1] = 0
 
-	# update robot drawing
-	def draw(self):
-		return
-		#self.map.updateRobot(self)
-		#self.map.updateGas()
-
-	def fileWrite(self):
-		self.curtime = time.time()
-		f = "%s \n" %[self.curposKal,self.curtime, self.curpos, self.curgas]
-		self.file.write(f)
+	def fileWrite(self, t=None):
+		self.curtime = time.time() if t is None else t
+		self.log.write(self.curtime, self.id, self.curposKal, self.curpos, self.curgas)
 
+	# newest pose the camera has for our tag, KeyError if it hasn't seen it yet
 	def aprilTag(self):
-		tagpackt = AprilTag.tagdic	#apriltag file/thread saves data from each tag ID to a dictionary in the id position
-		tagpackt = tagpackt[self.id]
-		self.curposAT = [tagpackt[i] for i in (0,1,2)]
-		self.curangAT = [tagpackt[i] for i in (3,4,5)]
+		fix = AprilTag.poses.latest(self.id)
+		self.curposAT = fix[TagPoseStore.X:TagPoseStore.Z + 1].tolist()
+		self.curangAT = fix[TagPoseStore.YAW:TagPoseStore.ROLL + 1].tolist()
+		self.tagTime = fix[TagPoseStore.RECEIVE]
+
+	# x, y, theta of our tag at each of the times (base clock), N x 3
+	# the newest fix for all of them if the camera hasn't seen us
+	def tagPoses(self, times):
+		try:
+			poses = AprilTag.poses.posesAt(self.id, times)
+		except KeyError:
+			return np.tile([self.curposAT[0], self.curposAT[1], self.curangAT[1]], (len(times), 1))
+		return poses[:, [TagPoseStore.X, TagPoseStore.Y, TagPoseStore.HEADING]]
+
+	# whether the camera has seen our tag lately, a stale fix means
+	# curposAT is where we were, not where we are
+	def tagFresh(self):
+		return AprilTag.poses.isFresh(self.id)
 
 	# run comm once at first to get initial readings
 	# then have it last so the exit call doesn't mess up the other funcs
 	def run(self):
-		time.sleep(10)
-		self.comm()
+		if self.scheduled:
+			self.runScheduled()
+			return
+		if self.duplex:
+			self.runDuplex()
+			return
+		# local so a reconnect swapping self.conn doesn't confuse this loop
+		conn = self.conn
+		try:
+			self.warmUp()
+			self.comm(conn)
+			self.start = time.time()
+			self.curtime = self.start
+
+			while self.keepRunning:
+				self.findV(self.snapshot())
+				self.aprilTag() # new data to be analyzed with comms, can send back almost immeditely as well
+				self.comm(conn)
+				self.fileWrite()
+		except (ConnectionError, OSError):
+			print("Robot", self.id, "dropped")
+
+	# give everything else (apriltags) a chance to start up on the first connection
+	# a robot coming back after a drop goes straight to work
+	def warmUp(self):
+		if self.connections == 1:
+			time.sleep(10)
+
+	# pick up on a new connection after a drop, everything else is kept
+	# if the old connection still looks alive it gets cut so its loop ends
+	def reconnect(self, conn):
+		old = self.conn
+		self.conn = conn
+		self.connections += 1
+		self.keepRunning = True
+		if isinstance(old, socket.socket) and old is not conn:
+			# shutdown wakes up a thread blocked reading it, close gives the socket back
+			try:
+				old.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+			old.close()
+		elif old is not None and old is not conn:
+			old.close()
+
+	# full duplex version of run
+	# telemetry gets handled on the link's thread as it comes in and this loop
+	# plans off whatever is newest, sending each new command straight away
+	def runDuplex(self):
+		# local so a reconnect swapping self.link doesn't confuse this loop
+		link = encode.DuplexLink(self.conn, onMessage=self.onMessage).start()
+		self.link = link
+		try:
+			self.warmUp()
+			# need one reading before there is anything to plan on
+			while link.newest(timeout=1) is None:
+				if link.closed:
+					return
+			self.start = time.time()
+			self.curtime = self.start
+
+			while self.keepRunning and not link.closed:
+				try:
+					self.plan()
+				except KeyError:
+					# no apriltag fix for this one yet, nothing to send
+					pass
+				else:
+					link.send(encode.command(self.desired), encode.MSG_COMMAND)
+					self.fileWrite()
+				# don't spin faster than the telemetry
+				link.newest(timeout=Robot.DUPLEX_WAIT)
+		except OSError:
+			print("Robot", self.id, "dropped")
+		finally:
+			self.closeLink(link)
+
+	# scheduler mode: the base's Scheduler plans and sends for the whole fleet
+	# this thread just holds the link open until it's time to go
+	def runScheduled(self):
+		link = encode.DuplexLink(self.conn, onMessage=self.onMessage).start()
+		self.link = link
+		while self.keepRunning and not link.closed:
+			link.newest(timeout=.5)
+		self.closeLink(link)
+
+	# called by the Scheduler with this tick's command
+	def sendCommand(self, desired):
+		link = self.link
+		if link is None or link.closed:
+			return
+		try:
+			link.send(encode.command(desired), encode.MSG_COMMAND)
+		except OSError:
+			# reader thread sees the drop too and ends the run
+			return
+		self.fileWrite()
+
+	# say goodbye on a duplex link and close it
+	def closeLink(self, link):
+		if not link.closed:
+			try:
+				# send out packet and wait for confirmation of reception
+				link.send("out")
+				while link.newest(timeout=1) != "out" and not link.closed:
+					pass
+			except OSError:
+				pass
+		print("Closing Connection")
+		link.close()
+
+	# one planning step: pick velocities from the newest readings
+	# works off one published state, the newest if none is given, so telemetry
+	# coming in on the link's thread can't change the reading halfway through
+	def plan(self, state=None):
+		self.findV(self.snapshot() if state is None else state)
+		self.aprilTag()
+		self.packDesired()
+
+	# asyncio version of run, one of these per robot on the base's event loop
+	# comms stay on the loop, planning and mapping go to the executor
+	async def runAsync(self, reader, writer, executor=None):
+		if self.connections == 1:
+			await asyncio.sleep(10)
 		self.start = time.time()
 		self.curtime = self.start
+		try:
+			if self.duplex:
+				await self.duplexAsync(reader, writer, executor)
+			else:
+				await self.lockstepAsync(reader, writer, executor)
+			# send out packet and wait for confirmation of reception
+			await encode.sendPacketAsync(writer, "out", seq=self.nextSeq(), ack=self.ack)
+			while (await encode.recievePacketAsync(reader)) != "out":
+				pass
+		except (asyncio.IncompleteReadError, ConnectionError):
+			print("Robot", self.id, "dropped")
+		finally:
+			print("Closing Connection")
+			writer.close()
 
+	# take turns with the robot: reading in, command out
+	async def lockstepAsync(self, reader, writer, executor):
+		loop = asyncio.get_running_loop()
 		while self.keepRunning:
-			self.findV()
-			self.draw()
-			self.aprilTag() # new data to be analyzed with comms, can send back almost immeditely as well
-			self.comm()
+			msg = await encode.recievePacketAsync(reader)
+			await loop.run_in_executor(executor, self.recieveTelemetry, msg)
+			await loop.run_in_executor(executor, self.plan)
+			await encode.sendPacketAsync(writer, encode.command(self.desired), encode.MSG_COMMAND)
 			self.fileWrite()
+
+	# duplex: one coroutine takes in whatever the robot streams, this one
+	# plans off the newest of it and sends each new command straight away
+	async def duplexAsync(self, reader, writer, executor):
+		loop = asyncio.get_running_loop()
+		fresh = asyncio.Event()
+
+		async def recieve():
+			while True:
+				frame = await encode.recieveFrameAsync(reader)
+				self.ack = frame.seq
+				if frame.msg == "out":
+					return
+				await loop.run_in_executor(executor, self.onMessage, frame.msg)
+				fresh.set()
+
+		reading = asyncio.ensure_future(recieve())
+		try:
+			# need one reading before there is anything to plan on
+			first = asyncio.ensure_future(fresh.wait())
+			await asyncio.wait([reading, first], return_when=asyncio.FIRST_COMPLETED)
+			first.cancel()
+			while self.keepRunning and not reading.done():
+				fresh.clear()
+				try:
+					await loop.run_in_executor(executor, self.plan)
+				except KeyError:
+					# no apriltag fix for this one yet, nothing to send
+					pass
+				else:
+					await encode.sendPacketAsync(writer, encode.command(self.desired), encode.MSG_COMMAND, seq=self.nextSeq(), ack=self.ack)
+					self.fileWrite()
+				# don't spin faster than the telemetry
+				try:
+					await asyncio.wait_for(fresh.wait(), Robot.DUPLEX_WAIT)
+				except asyncio.TimeoutError:
+					pass
+		finally:
+			reading.cancel()
+		if reading.done() and not reading.cancelled() and reading.exception() is not None:
+			raise reading.exception()
+
+	def nextSeq(self):
+		self.seq = (self.seq + 1) & 0xFFFFFFFF
+		return self.seq
+
 	def terminate(self):
-		#Map.savefile("GasMap.gif", self.map)  # added to save map as file, need to confirm this works as planned
 		self.keepRunning = False
 
 	###################
@@ -0,0 +1,319 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# RunLog.py
+#
+# Binary run log
+# the control loop drops a record in a queue and moves on, a writer thread
+# packs them into fixed width binary records and writes them in big chunks.
+# every chunk is grouped by robot and each group gets a line in a small
+# index file next to the log, so RunReader can memory map the log and only
+# touch the pages a query needs
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import os
+import re
+import ast
+import time
+import queue
+import atexit
+import argparse
+import threading
+
+import numpy as np
+
+
+# file starts with MAGIC, then the version and record size as uint32s
+MAGIC = b'PLUMELOG'
+VERSION = 1
+
+# one record per robot per control loop, little endian
+RECORD = np.dtype([
+	('t', '<f8'),			# s, base clock
+	('robot_id', '<i4'),
+	('kal_x', '<f8'),		# robot's own (Kalman filter) estimate
+	('kal_y', '<f8'),
+	('kal_theta', '<f8'),
+	('x', '<f8'),			# position the base used (apriltag)
+	('y', '<f8'),
+	('theta', '<f8'),
+	('gas', '<f8', (4,)),
+])
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+
+# one entry per run of records from one robot, offset and count in records
+INDEX = np.dtype([
+	('robot_id', '<i4'),
+	('count', '<u4'),
+	('offset', '<u8'),
+	('tmin', '<f8'),
+	('tmax', '<f8'),
+])
+INDEX_SUFFIX = '.idx'
+
+# when to fsync: never, after every chunk written, or only on close
+FSYNC_POLICIES = ('never', 'chunk', 'close')
+
+
+# log file and its index, written a chunk of records at a time
+class RunFile:
+	def __init__(self, filename, fsync='close'):
+		if fsync not in FSYNC_POLICIES:
+			raise ValueError("fsync must be one of %s" % (FSYNC_POLICIES,))
+		self.filename = filename
+		self.fsync = fsync
+		self.records = 0
+
+		self.file = open(filename, 'wb')
+		header = np.zeros(1, HEADER)
+		header[0] = (MAGIC, VERSION, RECORD.itemsize)
+		self.file.write(header.tobytes())
+		self.index = open(filename + INDEX_SUFFIX, 'wb')
+
+	# records grouped by robot (keeping time order within each robot),
+	# one index entry per group
+	def write(self, records):
+		if len(records) == 0:
+			return
+		records = records[np.argsort(records['robot_id'], kind='stable')]
+		index = makeIndex(records, self.records)
+
+		# data first, an index entry never points past the end of the log
+		self.file.write(records.tobytes())
+		self.file.flush()
+		self.index.write(index.tobytes())
+		self.index.flush()
+		if self.fsync == 'chunk':
+			os.fsync(self.file.fileno())
+			os.fsync(self.index.fileno())
+		self.records += len(records)
+
+	def close(self):
+		if self.fsync != 'never':
+			os.fsync(self.file.fileno())
+			os.fsync(self.index.fileno())
+		self.file.close()
+		self.index.close()
+
+
+class RunLogger:
+	def __init__(self, filename, chunkRows=4096, flushInterval=1.0, fsync='close', maxQueue=65536):
+		self.file = RunFile(filename, fsync)
+		self.filename = filename
+		self.flushInterval = flushInterval
+
+		self.queue = queue.Queue(maxQueue)
+		self.chunk = np.zeros(chunkRows, RECORD)
+		self.rows = 0
+
+		# counters
+		self.written = 0
+		self.dropped = 0	# queue was full, record thrown away instead of holding up the caller
+
+		self.closed = False
+		self.thread = threading.Thread(target=self.writeLoop, daemon=True)
+		self.thread.start()
+		atexit.register(self.close)
+
+	# queue one record, never blocks
+	# kal and pos are (x, y, theta), gas up to 4 readings
+	def write(self, t, robot_id, kal, pos, gas):
+		gas = list(gas)[:4]
+		gas += [np.nan] * (4 - len(gas))
+		try:
+			self.queue.put_nowait((t, robot_id, kal[0], kal[1], kal[2], pos[0], pos[1], pos[2], gas))
+		except queue.Full:
+			self.dropped += 1
+
+	def writeLoop(self):
+		lastFlush = time.time()
+		while True:
+			try:
+				record = self.queue.get(timeout=self.flushInterval)
+			except queue.Empty:
+				record = None
+			if record is not None:
+				self.chunk[self.rows] = record
+				self.rows += 1
+			if self.rows == len(self.chunk) or (self.rows and time.time() - lastFlush >= self.flushInterval):
+				self.writeChunk()
+				lastFlush = time.time()
+			if self.closed and self.queue.empty():
+				break
+		self.writeChunk()
+
+	def writeChunk(self):
+		if self.rows == 0:
+			return
+		self.file.write(self.chunk[:self.rows])
+		self.written += self.rows
+		self.rows = 0
+
+	# write out everything still queued and close the file
+	def close(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.thread.join()
+		self.file.close()
+
+
+# reads a run log through a memory map
+# only the index is read up front, records are paged in as queries touch them
+class RunReader:
+	def __init__(self, filename):
+		header = np.fromfile(filename, HEADER, count=1)
+		if len(header) == 0 or header[0]['magic'] != MAGIC:
+			raise ValueError("%s is not a run log" % filename)
+		if header[0]['version'] != VERSION or header[0]['record_size'] != RECORD.itemsize:
+			raise ValueError("%s is run log version %d, expected %d" % (filename, header[0]['version'], VERSION))
+		self.filename = filename
+
+		# a chunk still being written can leave a partial record at the end
+		count = (os.path.getsize(filename) - HEADER.itemsize) // RECORD.itemsize
+		if count:
+			self.records = np.memmap(filename, RECORD, 'r', offset=HEADER.itemsize, shape=(count,))
+		else:
+			self.records = np.zeros(0, RECORD)
+
+		if os.path.exists(filename + INDEX_SUFFIX):
+			index = np.fromfile(filename + INDEX_SUFFIX, INDEX)
+			self.index = index[index['offset'] + index['count'] <= count]
+		else:
+			self.index = buildIndex(self.records)
+
+	def __len__(self):
+		return len(self.records)
+
+	def robots(self):
+		return np.unique(self.index['robot_id'])
+
+	# records with t0 <= t <= t1 from the given robot, in the order they were
+	# logged, anything left as None matches everything
+	def query(self, robot_id=None, t0=None, t1=None):
+		t0 = -np.inf if t0 is None else t0
+		t1 = np.inf if t1 is None else t1
+		index = self.index
+		mask = (index['tmax'] >= t0) & (index['tmin'] <= t1)
+		if robot_id is not None:
+			mask &= index['robot_id'] == robot_id
+		parts = []
+		for entry in index[mask]:
+			part = self.records[entry['offset']:entry['offset'] + entry['count']]
+			parts.append(part[(part['t'] >= t0) & (part['t'] <= t1)])
+		if not parts:
+			return np.zeros(0, RECORD)
+		return np.concatenate(parts)
+
+
+# index entries for records starting at offset in the log,
+# one per run of records from the same robot
+def makeIndex(records, offset=0):
+	ids = np.asarray(records['robot_id'])
+	starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+	index = np.zeros(len(starts), INDEX)
+	index['robot_id'] = ids[starts]
+	index['count'] = np.diff(np.r_[starts, len(records)])
+	index['offset'] = offset + starts
+	index['tmin'] = np.minimum.reduceat(records['t'], starts)
+	index['tmax'] = np.maximum.reduceat(records['t'], starts)
+	return index
+
+
+# index for a log that lost its index file, read a piece at a time
+def buildIndex(records, step=65536):
+	parts = [makeIndex(records[start:start + step], start) for start in range(0, len(records), step)]
+	return np.concatenate(parts) if parts else np.zeros(0, INDEX)
+
+
+# whole run as a (memory mapped) array of RECORDs
+def loadRun(filename):
+	return RunReader(filename).records
+
+
+#############################
+# Converting old text logs   #
+#############################
+
+# numpy and sympy numbers print as np.float64(1.5) or Float('1.5', precision=53)
+WRAPPED = re.compile(r"[A-Za-z_][\w.]*\(\s*'?([-+\w.]+)'?[^()]*\)")
+
+
+def parseLine(line):
+	line = line.strip()
+	try:
+		return ast.literal_eval(line)
+	except (ValueError, SyntaxError):
+		return ast.literal_eval(WRAPPED.sub(r'\1', line))
+
+
+# "Kalman Filter - <time>.csv" from Robot.fileWrite before the binary log,
+# one [curposKal, time, curpos, curgas] list per line
+# the robot ID isn't in the file so it has to be given
+def convertKalman(textname, filename, robot_id=0, chunkRows=4096):
+	out = RunFile(filename)
+	chunk = np.zeros(chunkRows, RECORD)
+	rows = 0
+	with open(textname) as f:
+		for line in f:
+			if not line.startswith('['):
+				continue	# header
+			kal, t, pos, gas = parseLine(line)
+			gas = list(gas)[:4]
+			gas += [np.nan] * (4 - len(gas))
+			chunk[rows] = (t, robot_id, kal[0], kal[1], kal[2], pos[0], pos[1], pos[2], gas)
+			rows += 1
+			if rows == chunkRows:
+				out.write(chunk)
+				rows = 0
+	out.write(chunk[:rows])
+	out.close()
+	return out.records
+
+
+# 'predicted position' from the robot's savePosn, one [x, y, theta] per line
+# the file has no times, line i is given t = start + i * period
+# only the Kalman columns are filled in, the rest are nan
+def convertPredicted(textname, filename, robot_id=0, start=0.0, period=1.0, chunkRows=4096):
+	out = RunFile(filename)
+	chunk = np.zeros(chunkRows, RECORD)
+	rows = 0
+	i = 0
+	with open(textname) as f:
+		for line in f:
+			if not line.strip():
+				continue
+			kal = parseLine(line)
+			chunk[rows] = (start + i * period, robot_id, kal[0], kal[1], kal[2], np.nan, np.nan, np.nan, [np.nan] * 4)
+			rows += 1
+			i += 1
+			if rows == chunkRows:
+				out.write(chunk)
+				rows = 0
+	out.write(chunk[:rows])
+	out.close()
+	return out.records
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="convert an old text log to a binary run log")
+	parser.add_argument("textname", help="'Kalman Filter - <time>.csv' or 'predicted position' file")
+	parser.add_argument("filename", help="run log to write")
+	parser.add_argument("--ID", dest='id', type=int, help="robot ID the log came from", default=0)
+	parser.add_argument("--PREDICTED", dest='predicted', action='store_true', help="textname is a robot's 'predicted position' file")
+	parser.add_argument("--START", dest='start', type=float, help="time of the first predicted position", default=0.0)
+	parser.add_argument("--PERIOD", dest='period', type=float, help="seconds between predicted positions", default=1.0)
+	args = parser.parse_args()
+	if args.predicted:
+		count = convertPredicted(args.textname, args.filename, args.id, args.start, args.period)
+	else:
+		count = convertKalman(args.textname, args.filename, args.id)
+	print("wrote", count, "records to", args.filename)
@@ -0,0 +1,226 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# SampleStore.py
+#
+# Every gas reading of the run, stored by column
+# rows go into fixed size numpy chunks, a full chunk is never copied or
+# touched again, so appends stay cheap no matter how long the run goes.
+# with a hot row limit only each robot's newest chunks stay in memory,
+# older ones are spilled to an append only file and read back memory mapped
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import threading
+
+import numpy as np
+
+
+# name and type of every column
+COLUMNS = [
+	('t', np.float64),			# s, base clock
+	('x', np.float64),			# m
+	('y', np.float64),			# m
+	('concentration', np.float64),
+	('robot_id', np.int32),
+	('sensor_index', np.int8),
+]
+# one row of the spill file
+SPILL = np.dtype(COLUMNS)
+
+
+# what a block of rows covers, lets queries skip whole blocks
+class Bounds:
+	def overlaps(self, t0, t1, region):
+		if self.count == 0 or self.tmax < t0 or self.tmin > t1:
+			return False
+		if region is not None:
+			x0, y0, x1, y1 = region
+			if self.xmax < x0 or self.xmin > x1 or self.ymax < y0 or self.ymin > y1:
+				return False
+		return True
+
+
+class Chunk(Bounds):
+	def __init__(self, size):
+		self.columns = {name: np.empty(size, dtype) for name, dtype in COLUMNS}
+		self.size = size
+		self.count = 0
+		# bounds of what's in here, lets queries skip whole chunks
+		self.tmin = self.xmin = self.ymin = np.inf
+		self.tmax = self.xmax = self.ymax = -np.inf
+
+	# copy rows start:end of the values into the free space
+	def fill(self, values, start, end):
+		n = end - start
+		for name, column in self.columns.items():
+			column[self.count:self.count + n] = values[name][start:end]
+		t, x, y = (values[name][start:end] for name in ('t', 'x', 'y'))
+		self.tmin, self.tmax = min(self.tmin, t.min()), max(self.tmax, t.max())
+		self.xmin, self.xmax = min(self.xmin, x.min()), max(self.xmax, x.max())
+		self.ymin, self.ymax = min(self.ymin, y.min()), max(self.ymax, y.max())
+		self.count += n
+
+	# zero copy views of the rows filled so far
+	def views(self):
+		count = self.count
+		return {name: column[:count] for name, column in self.columns.items()}
+
+	def nbytes(self):
+		return sum(column.nbytes for column in self.columns.values())
+
+
+# a chunk that's been written out to the spill file
+class Spilled(Bounds):
+	def __init__(self, chunk, robot_id, offset):
+		self.robot_id = robot_id
+		self.offset = offset	# rows
+		self.count = chunk.count
+		self.tmin, self.tmax = chunk.tmin, chunk.tmax
+		self.xmin, self.xmax = chunk.xmin, chunk.xmax
+		self.ymin, self.ymax = chunk.ymin, chunk.ymax
+
+	def views(self, mapped):
+		rows = mapped[self.offset:self.offset + self.count]
+		return {name: rows[name] for name, dtype in COLUMNS}
+
+
+class SampleStore:
+	CHUNK = 16384
+
+	# hotRows is how many of each robot's newest rows to keep in memory, at
+	# least, older chunks go to the spill file, 0 keeps everything in memory
+	# with a limit chunks are at most a quarter of it, so it's never more
+	# than a quarter over and a small limit still spills
+	def __init__(self, chunkSize=CHUNK, hotRows=0, spill=None):
+		if hotRows and spill is None:
+			raise ValueError("a hot row limit needs a spill file")
+		if hotRows:
+			chunkSize = min(chunkSize, max(1, hotRows // 4))
+		self.chunkSize = chunkSize
+		self.hotRows = hotRows
+		self.hot = {}		# robot_id -> Chunks in memory, oldest first
+		self.spilled = []	# Spilled, oldest first
+		self.spillName = spill
+		self.spillFile = open(spill, 'wb') if spill else None
+		self.mapped = None	# memmap of the spill file, remade as it grows
+		self.lock = threading.Lock()	# appends come from every robot's thread
+
+		# counters
+		self.count = 0
+		self.spilledRows = 0
+		self.memory = 0		# bytes of chunks in memory
+		self.peakMemory = 0
+
+	def __len__(self):
+		return self.count
+
+	# add rows, every argument is a scalar or an array (all arrays the same length)
+	def append(self, t, x, y, concentration, robot_id, sensor_index):
+		columns = np.broadcast_arrays(*map(np.atleast_1d, (t, x, y, concentration, robot_id, sensor_index)))
+		values = {name: column for (name, dtype), column in zip(COLUMNS, columns)}
+		ids = values['robot_id']
+		with self.lock:
+			if (ids == ids[0]).all():
+				self.appendRobot(int(ids[0]), values)
+				return
+			for id in np.unique(ids):
+				mask = ids == id
+				self.appendRobot(int(id), {name: column[mask] for name, column in values.items()})
+
+	def appendRobot(self, robot_id, values):
+		chunks = self.hot.setdefault(robot_id, [])
+		n = len(values['t'])
+		done = 0
+		while done < n:
+			if not chunks or chunks[-1].count == chunks[-1].size:
+				chunks.append(Chunk(self.chunkSize))
+				self.memory += chunks[-1].nbytes()
+				self.peakMemory = max(self.peakMemory, self.memory)
+			chunk = chunks[-1]
+			take = min(n - done, chunk.size - chunk.count)
+			chunk.fill(values, done, done + take)
+			done += take
+			# readers only look at rows below count, so bump it last
+			self.count += take
+		if self.hotRows:
+			# spill the oldest chunk once the newer ones hold enough on their own
+			while len(chunks) > 1 and sum(chunk.count for chunk in chunks[1:]) >= self.hotRows:
+				self.spill(robot_id, chunks[0])
+				chunks.pop(0)
+
+	def spill(self, robot_id, chunk):
+		rows = np.empty(chunk.count, SPILL)
+		for name, column in chunk.views().items():
+			rows[name] = column
+		self.spillFile.write(rows.tobytes())
+		self.spillFile.flush()
+		self.spilled.append(Spilled(chunk, robot_id, self.spilledRows))
+		self.spilledRows += chunk.count
+		self.memory -= chunk.nbytes()
+
+	# every block of rows as (robot_id, Chunk or Spilled), spilled ones first
+	# and the memory map to read the spilled ones through
+	def blocks(self):
+		with self.lock:
+			spilled = list(self.spilled)
+			hot = [(robot_id, chunk) for robot_id, chunks in self.hot.items() for chunk in chunks]
+			spilledRows = self.spilledRows
+		if spilledRows and (self.mapped is None or len(self.mapped) < spilledRows):
+			self.mapped = np.memmap(self.spillName, SPILL, 'r', shape=(spilledRows,))
+		return [(block.robot_id, block) for block in spilled] + hot, self.mapped
+
+	# zero copy views of every block, one dict of columns each
+	# spilled rows first, then each robot's rows in memory, oldest first
+	def views(self):
+		blocks, mapped = self.blocks()
+		return [block.views(mapped) if isinstance(block, Spilled) else block.views() for robot_id, block in blocks]
+
+	# one column for the whole run, copied into a single array
+	def column(self, name):
+		parts = [views[name] for views in self.views()]
+		if not parts:
+			return np.empty(0, dict(COLUMNS)[name])
+		return np.concatenate(parts)
+
+	# rows with t0 <= t <= t1, inside region (x0, y0, x1, y1) and from the
+	# given robot/sensor, anything left as None matches everything
+	# returns a dict of column arrays, in the same order as views
+	def query(self, t0=None, t1=None, region=None, robot_id=None, sensor_index=None):
+		t0 = -np.inf if t0 is None else t0
+		t1 = np.inf if t1 is None else t1
+		parts = {name: [] for name, dtype in COLUMNS}
+		blocks, mapped = self.blocks()
+		for id, block in blocks:
+			if robot_id is not None and id != robot_id:
+				continue
+			if not block.overlaps(t0, t1, region):
+				continue
+			views = block.views(mapped) if isinstance(block, Spilled) else block.views()
+			mask = (views['t'] >= t0) & (views['t'] <= t1)
+			if region is not None:
+				x0, y0, x1, y1 = region
+				mask &= (views['x'] >= x0) & (views['x'] <= x1) & (views['y'] >= y0) & (views['y'] <= y1)
+			if sensor_index is not None:
+				mask &= views['sensor_index'] == sensor_index
+			for name in parts:
+				parts[name].append(views[name][mask])
+		result = {}
+		for name, dtype in COLUMNS:
+			result[name] = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype)
+		return result
+
+	def report(self):
+		return "%d gas samples, %d spilled to disk | memory %.1f MB, peak %.1f MB" % (
+			self.count, self.spilledRows, self.memory / 1e6, self.peakMemory / 1e6)
+
+	def close(self):
+		if self.spillFile is not None:
+			self.spillFile.close()
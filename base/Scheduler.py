@@ -0,0 +1,136 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# Scheduler.py
+#
+# Ticks the whole fleet at a fixed rate
+# every tick plans every robot off its latest state, then sends all the
+# commands in one go. keeps score of how long ticks take and how late they start
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import time
+import bisect
+import threading
+
+
+# tick timing, all in ms
+class TickStats:
+	# histogram bin edges, last bin catches everything past the end
+	EDGES = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+	def __init__(self, period):
+		self.period = period
+		self.ticks = 0
+		self.overruns = 0	# ticks that took longer than the period
+		self.skipped = 0	# ticks never started because we were behind
+		self.durationSum = 0
+		self.durationMax = 0
+		self.jitterMax = 0
+		self.durations = [0] * (len(TickStats.EDGES) + 1)
+		self.jitters = [0] * (len(TickStats.EDGES) + 1)
+
+	# duration: how long the tick took, jitter: how late it started (s)
+	def record(self, duration, jitter):
+		duration *= 1000
+		jitter *= 1000
+		self.ticks += 1
+		self.durationSum += duration
+		self.durationMax = max(self.durationMax, duration)
+		self.jitterMax = max(self.jitterMax, jitter)
+		self.durations[bisect.bisect_left(TickStats.EDGES, duration)] += 1
+		self.jitters[bisect.bisect_left(TickStats.EDGES, jitter)] += 1
+
+	# value below which fraction q of the ticks fall, to histogram resolution
+	@staticmethod
+	def quantile(counts, q):
+		total = sum(counts)
+		if total == 0:
+			return 0
+		seen = 0
+		for i, count in enumerate(counts):
+			seen += count
+			if seen >= q * total:
+				return TickStats.EDGES[i] if i < len(TickStats.EDGES) else float('inf')
+		return float('inf')
+
+	@staticmethod
+	def histogram(counts):
+		labels = ["<=%g" % edge for edge in TickStats.EDGES] + [">%g" % TickStats.EDGES[-1]]
+		return " ".join("%s:%d" % (label, count) for label, count in zip(labels, counts) if count)
+
+	def report(self):
+		mean = self.durationSum / self.ticks if self.ticks else 0
+		return ("%d ticks at %.1f Hz, %d overruns, %d skipped\n"
+				"  tick ms   mean %.2f p99 <=%g max %.2f | %s\n"
+				"  jitter ms p50 <=%g p99 <=%g max %.2f | %s") % (
+			self.ticks, 1 / self.period, self.overruns, self.skipped,
+			mean, TickStats.quantile(self.durations, .99), self.durationMax, TickStats.histogram(self.durations),
+			TickStats.quantile(self.jitters, .5), TickStats.quantile(self.jitters, .99), self.jitterMax,
+			TickStats.histogram(self.jitters))
+
+
+class Scheduler:
+	def __init__(self, fleet, hz, reportEvery=10):
+		self.fleet = fleet
+		self.period = 1.0 / hz
+		self.reportEvery = reportEvery
+		self.stats = TickStats(self.period)
+		self.keepRunning = True
+
+	# plan every robot that has something to plan on, then send everything
+	def tick(self):
+		commands = []
+		for robot in self.fleet.live():
+			# one snapshot per robot per tick, planned on as a whole
+			state = robot.snapshot()
+			if not state.lastTelemetry:
+				continue
+			try:
+				robot.plan(state)
+			except KeyError:
+				# no apriltag fix for this one yet
+				continue
+			commands.append((robot, list(robot.snapshot().desired)))
+		for robot, desired in commands:
+			robot.sendCommand(desired)
+
+	def run(self):
+		nextTick = time.perf_counter()
+		lastReport = nextTick
+		while self.keepRunning:
+			now = time.perf_counter()
+			if now < nextTick:
+				time.sleep(nextTick - now)
+			start = time.perf_counter()
+			self.tick()
+			end = time.perf_counter()
+			self.stats.record(end - start, start - nextTick)
+
+			nextTick += self.period
+			if end > nextTick:
+				# ran long, start the next one now and drop the ones we missed
+				self.stats.overruns += 1
+				missed = int((end - nextTick) / self.period)
+				self.stats.skipped += missed
+				nextTick += missed * self.period
+
+			if self.reportEvery and end - lastReport >= self.reportEvery:
+				print(self.stats.report())
+				lastReport = end
+
+	def start(self):
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		return self
+
+	def terminate(self):
+		self.keepRunning = False
+		print(self.stats.report())
@@ -0,0 +1,205 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# TagPoseStore.py
+#
+# Every pose the field cameras have reported, per tag
+# each tag gets a fixed size ring of its newest poses, so the newest one
+# is a single row lookup and a time range is two binary searches.
+# a tag more than one camera can see gets the blend of what they all saw
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import math
+import time
+import threading
+
+import numpy as np
+
+
+# columns of every row
+FIELDS = ('receive_time', 'camera_time', 'x', 'y', 'z', 'yaw', 'pitch', 'roll')
+RECEIVE, CAMERA, X, Y, Z, YAW, PITCH, ROLL = range(len(FIELDS))
+ANGLES = [YAW, PITCH, ROLL]
+# the angle the base takes as the robot's heading
+HEADING = PITCH
+
+
+class TagRing:
+	def __init__(self, size):
+		self.rows = np.full((size, len(FIELDS)), np.nan)
+		self.count = 0	# rows ever written, the newest is at (count - 1) % size
+
+	def append(self, row):
+		self.rows[self.count % len(self.rows)] = row
+		self.count += 1
+
+	def newest(self):
+		return self.rows[(self.count - 1) % len(self.rows)]
+
+	# the filled part of the ring as (older, newer) pieces, each in time order
+	def pieces(self):
+		size = len(self.rows)
+		if self.count <= size:
+			return self.rows[:0], self.rows[:self.count]
+		split = self.count % size
+		return self.rows[split:], self.rows[:split]
+
+
+class TagPoseStore:
+	# poses older than this (s) don't count as a fresh fix
+	STALE = .5
+	# furthest (s) a pose is carried forward past the newest fix
+	EXTRAPOLATE = .25
+	# blending cameras, a sighting's weight halves roughly every RECENCY * .7 s
+	# and falls off with distance from the camera past NEAR (m)
+	RECENCY = .1
+	NEAR = 1.0
+
+	def __init__(self, size=1024, stale=STALE, extrapolate=EXTRAPOLATE):
+		self.size = size	# poses kept per tag
+		self.stale = stale
+		self.extrapolate = extrapolate
+		self.rings = {}		# tag ID -> TagRing
+		self.seen = {}		# tag ID -> {camera: (newest row from it, distance)}
+		self.lock = threading.Lock()	# camera thread writes, robots read
+
+	def __contains__(self, tagid):
+		return tagid in self.rings
+
+	def tags(self):
+		return list(self.rings)
+
+	# one pose in the field frame, x y z yaw pitch roll
+	# receiveTime defaults to now, cameraTime is nan if the camera didn't say
+	def update(self, tagid, pose, cameraTime=None, receiveTime=None, camera=0, distance=None):
+		self.updateMany([(tagid, pose)], cameraTime, receiveTime, camera, None if distance is None else [distance])
+
+	# every (tag ID, pose) that came in together from one camera, one lock for the lot
+	# distances are how far each tag was from the camera, None if unknown
+	def updateMany(self, tags, cameraTime=None, receiveTime=None, camera=0, distances=None):
+		receiveTime = time.time() if receiveTime is None else receiveTime
+		cameraTime = np.nan if cameraTime is None else cameraTime
+		with self.lock:
+			for n, (tagid, pose) in enumerate(tags):
+				ring = self.rings.get(tagid)
+				if ring is None:
+					ring = self.rings[tagid] = TagRing(self.size)
+					self.seen[tagid] = {}
+				row = [receiveTime, cameraTime] + list(pose[:6])
+				row += [np.nan] * (len(FIELDS) - len(row))
+				seen = self.seen[tagid]
+				seen[camera] = (row, self.NEAR if distances is None else distances[n])
+				if len(seen) > 1:
+					row = self.fuse(seen, receiveTime, cameraTime)
+				ring.append(row)
+
+	# weighted blend of every camera's fresh sighting of one tag
+	# newer and closer sightings count for more, angles are averaged as directions
+	def fuse(self, seen, now, cameraTime):
+		rows = []
+		weights = []
+		for row, distance in seen.values():
+			age = now - row[RECEIVE]
+			if age > self.stale:
+				continue
+			rows.append(row)
+			weights.append(math.exp(-age / self.RECENCY) / (1 + (distance / self.NEAR) ** 2))
+		rows = np.array(rows)
+		weights = np.array(weights) / sum(weights)
+		fused = weights @ rows
+		angles = rows[:, ANGLES]
+		fused[ANGLES] = np.arctan2(weights @ np.sin(angles), weights @ np.cos(angles))
+		fused[RECEIVE] = now
+		fused[CAMERA] = cameraTime
+		return fused
+
+	# newest row for the tag, a copy, KeyError if it's never been seen
+	def latest(self, tagid):
+		with self.lock:
+			return self.rings[tagid].newest().copy()
+
+	# seconds since the tag was last seen, inf if never
+	def age(self, tagid, now=None):
+		now = time.time() if now is None else now
+		with self.lock:
+			ring = self.rings.get(tagid)
+			if ring is None:
+				return np.inf
+			return now - ring.newest()[RECEIVE]
+
+	def isFresh(self, tagid, maxAge=None, now=None):
+		return self.age(tagid, now) <= (self.stale if maxAge is None else maxAge)
+
+	# rows with t0 <= receive_time <= t1 (or camera_time), oldest first
+	# receive times only go up, so each piece of the ring is searched, not scanned
+	# camera times from several cameras don't, so those are picked out and sorted
+	def range(self, tagid, t0=None, t1=None, field=RECEIVE):
+		t0 = -np.inf if t0 is None else t0
+		t1 = np.inf if t1 is None else t1
+		with self.lock:
+			ring = self.rings.get(tagid)
+			if ring is None:
+				return np.empty((0, len(FIELDS)))
+			if field != RECEIVE:
+				rows = np.concatenate(ring.pieces())
+				times = rows[:, field]
+				rows = rows[(times >= t0) & (times <= t1)]
+				return rows[np.argsort(rows[:, field], kind='stable')]
+			parts = []
+			for piece in ring.pieces():
+				times = piece[:, field]
+				start = np.searchsorted(times, t0, 'left')
+				end = np.searchsorted(times, t1, 'right')
+				parts.append(piece[start:end])
+			return np.concatenate(parts)
+
+	# the tag's pose at each of the times, N x len(FIELDS) with the
+	# time columns set to the times asked for
+	# straight line between the fixes either side, angles the short way round,
+	# carried on along the last two fixes for up to extrapolate seconds past
+	# the newest and held at the oldest before that
+	# uses camera time if the camera sends it, receive time if not
+	# KeyError if the tag's never been seen
+	def posesAt(self, tagid, times):
+		times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+		with self.lock:
+			ring = self.rings[tagid]
+			field = RECEIVE if np.isnan(ring.newest()[CAMERA]) else CAMERA
+			rows = np.concatenate(ring.pieces())
+		# fixes from a camera that doesn't send its time can't be placed by it
+		rows = rows[~np.isnan(rows[:, field])]
+		# cameras with different latencies report out of camera time order
+		stamps = rows[:, field]
+		if np.any(stamps[1:] < stamps[:-1]):
+			rows = rows[np.argsort(stamps, kind='stable')]
+			stamps = rows[:, field]
+		if len(rows) == 1:
+			poses = np.repeat(rows, len(times), axis=0)
+			poses[:, RECEIVE] = poses[:, CAMERA] = times
+			return poses
+		# first fix after each time
+		i = np.clip(np.searchsorted(stamps, times, 'right'), 1, len(rows) - 1)
+		before, after = rows[i - 1], rows[i]
+
+		span = after[:, field] - before[:, field]
+		span[span <= 0] = np.inf	# same time twice, take the first
+		fraction = (times - before[:, field]) / span
+		fraction = np.clip(fraction, 0, 1 + self.extrapolate / span)[:, None]
+		change = after - before
+		change[:, ANGLES] = (change[:, ANGLES] + math.pi) % (2 * math.pi) - math.pi
+		poses = before + fraction * change
+		# going the short way round can step past +-pi
+		poses[:, ANGLES] = (poses[:, ANGLES] + math.pi) % (2 * math.pi) - math.pi
+		poses[:, RECEIVE] = poses[:, CAMERA] = times
+		return poses
+
+	def poseAt(self, tagid, t):
+		return self.posesAt(tagid, [t])[0]
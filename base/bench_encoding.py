@@ -0,0 +1,55 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# bench_encoding.py
+#
+# Microbenchmark for the comms codec
+# ns per message to encode and decode the robot/base messages,
+# fixed binary layouts vs the old everything-gets-pickled path
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import sys
+import timeit
+import argparse
+
+sys.path.append('libs/')
+from libs.custom_libs import encoding_TCP as encode
+
+# what actually goes over the wire every loop, and the layout it's sent in
+MESSAGES = {
+	"telemetry": ([[1.2345, -0.6789, 3.1], [412.0, 398.0, 455.0, 420.0]], encode.MSG_TELEMETRY),
+	"command": ([12.3, -36.1, 2, 1.2345, -0.6789, 0.42], encode.MSG_COMMAND),
+	"id": (3, encode.MSG_ID),
+}
+
+
+# ns per call of func, best of repeat
+def nsPer(func, number, repeat):
+	best = min(timeit.repeat(func, number=number, repeat=repeat))
+	return best / number * 1e9
+
+
+def bench(number, repeat):
+	print("%-10s %-7s %6s %12s %12s" % ("message", "codec", "bytes", "encode ns", "decode ns"))
+	for name, (msg, layout) in MESSAGES.items():
+		for codec, msgtype in (("binary", layout), ("pickle", encode.MSG_PICKLE)):
+			packet = encode.makePacket(msg, msgtype)
+			enc = nsPer(lambda: encode.makePacket(msg, msgtype), number, repeat)
+			dec = nsPer(lambda: encode.unmakePacket(packet), number, repeat)
+			print("%-10s %-7s %6d %12.0f %12.0f" % (name, codec, len(packet), enc, dec))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--N", dest='number', type=int, help="calls per timing run", default=100000)
+	parser.add_argument("--R", dest='repeat', type=int, help="timing runs, best is kept", default=5)
+	args = parser.parse_args()
+	bench(args.number, args.repeat)
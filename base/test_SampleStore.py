@@ -0,0 +1,90 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# test_SampleStore.py
+#
+# A hot row limit has to actually move readings to the spill file, even a
+# small one, and queries have to give the same answer either side of it
+# run from this directory: python3 -m pytest test_SampleStore.py
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import SampleStore
+
+
+class TestSpill(unittest.TestCase):
+	ROBOTS = 10
+	READINGS = 500	# per robot, four sensors each
+	HOT = 50
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.spill = os.path.join(self.directory, "gas.spill")
+		self.stores = [SampleStore.SampleStore(),
+					   SampleStore.SampleStore(hotRows=self.HOT, spill=self.spill)]
+		# the way robots add them, a batch of sensors at a time, robots taking turns
+		rng = np.random.default_rng(1)
+		for n in range(self.READINGS):
+			for id in range(self.ROBOTS):
+				t = n + id / self.ROBOTS
+				x, y = rng.uniform(-3, 3, 2)
+				con = rng.uniform(300, 500, 4)
+				for store in self.stores:
+					store.append(t, x, y, con, id, np.arange(4))
+		self.full, self.hot = self.stores
+
+	def tearDown(self):
+		for store in self.stores:
+			store.close()
+		os.remove(self.spill)
+		os.rmdir(self.directory)
+
+	def testSpills(self):
+		self.assertEqual(len(self.hot), self.ROBOTS * self.READINGS * 4)
+		self.assertGreater(self.hot.spilledRows, 0)
+		for id, chunks in self.hot.hot.items():
+			kept = sum(chunk.count for chunk in chunks)
+			self.assertGreaterEqual(kept, self.HOT)
+			self.assertLessEqual(kept, self.HOT + self.hot.chunkSize)
+		self.assertLess(self.hot.memory, self.full.memory)
+
+	def assertSameRows(self, **query):
+		full = self.full.query(**query)
+		hot = self.hot.query(**query)
+		# spilled rows come first, so put both in the same order before comparing
+		fullOrder = np.lexsort((full['sensor_index'], full['t']))
+		hotOrder = np.lexsort((hot['sensor_index'], hot['t']))
+		self.assertGreater(len(full['t']), 0)
+		for name, dtype in SampleStore.COLUMNS:
+			np.testing.assert_array_equal(full[name][fullOrder], hot[name][hotOrder], name)
+
+	def testQueryEverything(self):
+		self.assertSameRows()
+
+	# newest readings are in memory, older ones spilled, this takes from both
+	def testQueryAcrossBoundary(self):
+		t1 = self.READINGS
+		self.assertSameRows(t0=t1 - 2 * self.HOT, t1=t1)
+
+	def testQueryRobotRegionSensor(self):
+		self.assertSameRows(t0=100, region=(-1, -1, 2, 2), robot_id=3, sensor_index=2)
+
+	def testColumn(self):
+		np.testing.assert_array_equal(np.sort(self.full.column('concentration')), np.sort(self.hot.column('concentration')))
+
+
+if __name__ == "__main__":
+	unittest.main()
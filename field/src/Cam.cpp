@@ -16,6 +16,7 @@ Cam::Cam(int argc, char* argv[]) :
 // default settings, most can be modified through command line options (see below)
 m_tagDetector(NULL),
 m_tagCodes(AprilTags::tagCodes36h11),
+m_frameTime(0),
 
 m_draw(true),
 m_timing(false),
@@ -137,6 +138,7 @@ void Cam::processImage() {
 void Cam::loop() {
   // capture frame
   m_cap >> m_image;
+  m_frameTime = tic();
 
   processImage();
 }
@@ -169,3 +171,7 @@ double Cam::px(){
 double Cam::py(){
   return m_py;
 }
+
+double Cam::frameTime(){
+  return m_frameTime;
+}
@@ -50,6 +50,7 @@ private:
   vector<AprilTags::TagDetection> m_detections; // AprilTag Detections
 
   cv::Mat m_image;      // cur image
+  double m_frameTime;   // when m_image was captured, seconds since the epoch
   cv::Mat m_image_gray; // cur grayscale image
 
   bool m_draw; // draw image and April tag detections?
@@ -85,6 +86,7 @@ public:
   double fy();
   double px();
   double py();
+  double frameTime();
 
   Cam(int argc, char* argv[]);
   void loop();
@@ -9,6 +9,8 @@
 #include <errno.h>
 #include <sstream>
 #include <cstring>
+#include <stdint.h>
+#include <vector>
 
 //initialize field
 Field::Field(int argc, char* argv[])
@@ -20,6 +22,24 @@ Field::Field(int argc, char* argv[])
 //initialize mqpif
 static MQPIf mqpif;
 
+// Tags go to the base as one binary frame per camera frame (decoded by TagReader
+// in base/AprilTag.py), set false for the old one ASCII message per tag
+static const bool BINARY_FRAMES = true;
+
+// Binary frame, little endian (the x86/ARM hosts we run on):
+//   magic 0xA7 (uint8), tag count (uint16), capture time (double, s since the epoch)
+//   then per tag: ID (int32), x, y, z, yaw, ptc, rol, distance from the camera (double)
+static const unsigned char TAG_FRAME_MAGIC = 0xA7;
+static const size_t TAG_FRAME_HEADER = 1 + 2 + 8;
+static const size_t TAG_FRAME_TAG = 4 + 7 * 8;
+
+// copies value into the frame at p, returns where the next value goes
+template <typename T>
+static char* pack(char* p, T value) {
+  std::memcpy(p, &value, sizeof(T));
+  return p + sizeof(T);
+}
+
 // Opens the socket to send info to the Python code
 void Field::startSocket(){
   std::cout << "starting socket" << std::endl;
@@ -50,8 +70,13 @@ void Field::parseOptions(int argc, char* argv[]) {
 // updates robots with id corresponding to current apriltag IDs
 // creates robots if robot list does not have robot with ID needed
 void Field::updateRobots(){
-  for (unsigned int i = 0; i < m_cam.getTags().size(); i++){
-    AprilTags::TagDetection curTag = m_cam.getTags()[i];
+  std::vector<AprilTags::TagDetection> tags = m_cam.getTags();
+  std::vector<char> frame(TAG_FRAME_HEADER + tags.size() * TAG_FRAME_TAG);
+  char* next = frame.data() + TAG_FRAME_HEADER;
+  uint16_t count = 0;
+
+  for (unsigned int i = 0; i < tags.size(); i++){
+    AprilTags::TagDetection curTag = tags[i];
     int tagID = curTag.id;
 
     Eigen::Vector3d translation;
@@ -71,6 +96,24 @@ void Field::updateRobots(){
       m_robots.insert(std::pair<int,Robot>(tagID, curRobot));
     }
 
+    if (BINARY_FRAMES) {
+      try {
+        Pose pose = m_robots.at(tagID).diff();
+        next = pack<int32_t>(next, tagID);
+        next = pack<double>(next, pose.x());
+        next = pack<double>(next, pose.y());
+        next = pack<double>(next, pose.z());
+        next = pack<double>(next, pose.yaw());
+        next = pack<double>(next, pose.ptc());
+        next = pack<double>(next, pose.rol());
+        next = pack<double>(next, translation.norm());
+        count++;
+      } catch (std::out_of_range&) {
+        std::cout << "Robot " << tagID << " was not correctly added to list" << endl;
+      }
+      continue;
+    }
+
     try {
       std::stringstream ss;
       ss << tagID << ',';
@@ -95,6 +138,18 @@ void Field::updateRobots(){
       std::cout << "Error sending Robot" << tagID << std::endl;
     }
   }
+
+  if (BINARY_FRAMES && count > 0) {
+    char* header = frame.data();
+    header = pack<unsigned char>(header, TAG_FRAME_MAGIC);
+    header = pack<uint16_t>(header, count);
+    header = pack<double>(header, m_cam.frameTime());
+    try {
+      mqpif.sendFrame(frame.data(), TAG_FRAME_HEADER + count * TAG_FRAME_TAG);
+    } catch (const char *n_err) {
+      std::cout << n_err << std::endl;
+    }
+  }
 }
 
 // updates camera and apriltag locations
@@ -82,7 +82,9 @@ void MQPIf::disconnect()
 
 
 //////////////////////////////////////////////////////////////////////////////
-bool MQPIf::sendOne(const void *msg, const int msg_len)
+// Sends all len bytes, with SIGPIPE ignored so a dropped base doesn't kill us
+// Disconnects and throws if they don't all go
+void MQPIf::sendBytes(const void *bytes, const int len, const char *err)
 {
 	if (!connected) {
 		std::strcpy(result, "Not Connected");
@@ -98,19 +100,7 @@ bool MQPIf::sendOne(const void *msg, const int msg_len)
 	act.sa_flags	= 0;
 	sigaction(SIGPIPE, &act, &oact);
 
-	try {
-		// Send msg length
-		char	length[16];
-		::sprintf(length, "%d\n", msg_len);
-		int		len	= std::strlen(length);
-		if (::send(socket, length, len, 0) != len)
-			throw "Unable to send msg length";
-
-			// Send msg
-		if (::send(socket, msg, msg_len, 0) != msg_len)
-			throw "Unable to send msg";
-	}
-	catch (const char *err) {
+	if (::send(socket, bytes, len, 0) != len) {
 		::sprintf(result, "%s [%d]", err, errno);
 		ok	= false;
 
@@ -124,6 +114,29 @@ bool MQPIf::sendOne(const void *msg, const int msg_len)
 	if (!ok) {
 		throw result;
 	}
+}	// sendBytes()
+
+
+//////////////////////////////////////////////////////////////////////////////
+bool MQPIf::sendOne(const void *msg, const int msg_len)
+{
+	// Send msg length
+	char	length[16];
+	::sprintf(length, "%d\n", msg_len);
+	sendBytes(length, std::strlen(length), "Unable to send msg length");
+
+	// Send msg
+	sendBytes(msg, msg_len, "Unable to send msg");
 
 	return true;
 }	// sendOne()
+
+
+//////////////////////////////////////////////////////////////////////////////
+// Sends a frame that carries its own length (binary tag frames), as is
+bool MQPIf::sendFrame(const void *frame, const int frame_len)
+{
+	sendBytes(frame, frame_len, "Unable to send frame");
+
+	return true;
+}	// sendFrame()
@@ -18,6 +18,8 @@ private:
 
 	char		result[256];
 
+	void sendBytes(const void *bytes, const int len, const char *err);
+
 public:
 	MQPIf();
 	~MQPIf();
@@ -26,6 +28,7 @@ public:
 	void disconnect();
 
 	bool sendOne(const void *msg, const int msg_len);
+	bool sendFrame(const void *frame, const int frame_len);
 
 	const char * getResult()			{ return result; }
 };
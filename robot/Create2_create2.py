@@ -20,6 +20,7 @@ import math
 import socket
 import pickle
 import serial
+import threading
 import argparse
 import logging
 import sympy
@@ -47,7 +48,7 @@ class Robot:
 	CALI_TIME = 5	 # todo return to 60 following fixes
 	ANGMARG = .05
 
-	def __init__(self, id, ip, mode, usbport, inputs, ctrl):
+	def __init__(self, id, ip, mode, usbport, inputs, ctrl, duplex=False, batch=0, batchAge=.1):
 		if usbport is '0':
 			# robot initialization
 			self.ROBOT_SERIAL_PORT = "/dev/ttyUSB0"
@@ -72,6 +73,10 @@ class Robot:
 		self.id = id
 		self.input = inputs
 		self.ctrl = ctrl
+		self.duplex = duplex
+		# batch mode: gas is sampled on its own thread and sent in batches of this many rows
+		self.batch = batch
+		self.batchAge = batchAge
 
 		# position initalization
 		self.curpos = [0, 0, 0]  # x,y,theta (cm,cm,rad)
@@ -293,21 +298,75 @@ class Robot:
 		# send robot id so the base knows who is connecting
 		encode.sendPacket(sock=self.sock, message=self.id)
 
+		# duplex: commands come in on their own thread from here on
+		if self.duplex:
+			self.link = encode.DuplexLink(self.sock).start()
+		if self.batch:
+			self.batcher = encode.SampleBatcher(self.link.send, self.batch, self.batchAge)
+			self.sampler = threading.Thread(target=self.sampleLoop, daemon=True)
+			self.sampler.start()
+
 		return
 
+	# batch mode: read the COZIRs as fast as the Teensy answers and queue every
+	# reading with the pose it was taken at, the batcher sends them in bulk
+	def sampleLoop(self):
+		try:
+			while self.keepRunning:
+				self.requestGas()
+				self.updateGas()
+				self.batcher.add(time.time(), self.curpos, self.gas)
+			self.batcher.flush()
+		except OSError:
+			# link is gone, streamComms notices and shuts down
+			return
+
 	def loopComms(self):
-		snd = [self.curpos, self.gas]
+		if self.duplex:
+			self.streamComms()
+			return
+		snd = encode.telemetry(self.curpos, self.gas)
 		print("send coordinates:", snd)
 		# send curpos
-		encode.sendPacket(sock=self.sock, message=snd)
+		encode.sendPacket(sock=self.sock, message=snd, msgtype=encode.MSG_TELEMETRY)
 
 		# recieve message
 		rcv = encode.recievePacket(sock=self.sock)
 		print("rcv:", rcv)
+		self.handleCommand(rcv)
+		return
+
+	# duplex version of loopComms
+	# send telemetry and carry on, only act on a command if a new one came in
+	# in batch mode the sampler thread does the sending
+	def streamComms(self):
+		if not self.batch:
+			snd = encode.telemetry(self.curpos, self.gas)
+			try:
+				self.link.send(snd, encode.MSG_TELEMETRY)
+			except OSError:
+				print("exiting i guess :(")
+				self.quits()
+				return
+
+		rcv = self.link.newest()
+		if rcv is None:
+			if self.link.closed:
+				print("exiting i guess :(")
+				self.quits()
+			# nothing new, keep driving on the last command
+			return
+		print("rcv:", rcv)
+		self.handleCommand(rcv)
+		return
 
-		# determine what to do with message
+	# determine what to do with message
+	def handleCommand(self, rcv):
 		if rcv == "out":
-			encode.sendPacket(sock=self.sock, message="out")
+			if self.duplex:
+				self.link.send("out")
+			else:
+				encode.sendPacket(sock=self.sock, message="out")
 			self.quits()  # TODO: does this work?
 		elif rcv is None:  # base station not cooperating, this catches when it closes and there is an empty socket connection, and (should) gracefullly kill the robot
 			print("exiting i guess :(")
@@ -325,7 +384,10 @@ class Robot:
 	def terminateComms(self):
 		# close socket
 		print("Closing Socket")
-		self.sock.close()
+		if self.duplex:
+			self.link.close()
+		else:
+			self.sock.close()
 
 		return
 
@@ -435,10 +497,12 @@ class Robot:
 	# best chance to get loaction accurate to position
 	def main(self):
 		while self.keepRunning:
-			self.requestGas()
+			if not self.batch:
+				self.requestGas()
 			self.updatePosn()
 			self.savePosn()
-			self.updateGas()
+			if not self.batch:
+				self.updateGas()
 			self.loopComms()
 			self.tCoord()
 			self.move()
@@ -462,6 +526,11 @@ parser.add_argument("--mode", dest='mode', type=str, help="LKF, EKF, ENC", defau
 parser.add_argument("--usbport", dest='usbport', type=str, help="switches usb port if needed: 0,1", default="0")
 parser.add_argument("--IN", dest='inputs', type=int, help="apriltag 0 or encoder 1 for ekf input", default = 0)
 parser.add_argument("--ctrl", dest='ctrl', type=int, help="control choice for robot: 0 for pathing, 1 for direct straight, 2 for direct control of each wheel", default=0)
+parser.add_argument("--duplex", dest='duplex', action='store_true', help="stream telemetry without waiting on the base (base needs --DUPLEX too)")
+parser.add_argument("--batch", dest='batch', type=int, help="sample gas on its own thread and send this many readings per frame (needs --duplex)", default=0)
+parser.add_argument("--batchms", dest='batchms', type=float, help="longest a reading waits for its batch to fill, ms", default=100)
 args = parser.parse_args()
-robot = Robot(args.id, args.ip, args.mode, args.usbport, args.inputs, args.ctrl)
+if args.batch and not args.duplex:
+	parser.error("--batch needs --duplex")
+robot = Robot(args.id, args.ip, args.mode, args.usbport, args.inputs, args.ctrl, args.duplex, args.batch, args.batchms / 1000)
 robot.main()
@@ -236,11 +236,11 @@ class Robot:
 		return
 
 	def loopComms(self):
-		snd = [self.curpos, self.gas]
+		snd = encode.telemetry(self.curpos, self.gas)
 		print("send coordinates")
 		print(snd)
 		# send curpos
-		encode.sendPacket(sock=self.sock, message=snd)
+		encode.sendPacket(sock=self.sock, message=snd, msgtype=encode.MSG_TELEMETRY)
 
 		# recieve message
 		rcv = encode.recievePacket(sock=self.sock)
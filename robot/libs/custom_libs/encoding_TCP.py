@@ -18,7 +18,14 @@
 
 import socket
 import pickle
+import struct
+import array
 import sys
+import collections
+import weakref
+import threading
+import time
+import asyncio
 
 #max message size.
 #so help me god you send more than this
@@ -27,32 +34,398 @@ buffer_size = 4096
 #specify endianess for byte crossover
 ENDIANNESS = 'big'
 
-def makePacket(message):
-        #encode the message using pickle (serializes)
-        pmsg = pickle.dumps(message)
-        #get byte size of pickled message
-        size = len(pmsg)
-        #create bytearray message
-        packet = size.to_bytes(2, byteorder=ENDIANNESS)
-        packet += pmsg
-        return packet
+#bytes of length prefix in front of every frame
+HEADER_SIZE = 2
+
+#every frame is [length][version][type][seq][ack][payload]
+#length counts everything after itself
+#seq counts up with every frame a duplex link sends, ack is the newest seq it
+#has recieved from the other side. both stay 0 in request/response mode
+#bump the version whenever one of the layouts below changes
+PROTOCOL_VERSION = 3
+FRAME_HEADER = struct.Struct('>HBBII')
+#number of header fields in front of the payload values
+HEADER_FIELDS = 5
+
+#a decoded frame
+Frame = collections.namedtuple('Frame', ['seq', 'ack', 'msg'])
+
+#message types
+MSG_PICKLE = 0		#anything else, pickled
+MSG_ID = 1			#robot id sent on connect
+MSG_TELEMETRY = 2	#robot -> base [curpos(x,y,theta), gas(4 sensors)]
+MSG_COMMAND = 3		#base -> robot desired [x_dot, y_dot, gas index, AT x, AT y, AT theta]
+MSG_OUT = 4			#"out", shut the connection down
+MSG_SAMPLES = 5		#robot -> base SampleBatch of (timestamp, x, y, theta, gas[4]) rows
+
+#fixed layouts, packed as a whole frame (header included) in one go
+LAYOUTS = {
+	MSG_ID: struct.Struct('>HBBIIi'),
+	MSG_TELEMETRY: struct.Struct('>HBBII3d4d'),
+	MSG_COMMAND: struct.Struct('>HBBII2di3d'),
+	MSG_OUT: FRAME_HEADER,
+}
+
+#values per row of a sample batch: timestamp, x, y, theta, gas0..gas3
+SAMPLE_FIELDS = 8
+#most rows that fit in one frame
+MAX_SAMPLE_ROWS = (2 ** (8 * HEADER_SIZE) - 1 - (FRAME_HEADER.size - HEADER_SIZE)) // (8 * SAMPLE_FIELDS)
+
+#a run of gas samples sent as one frame
+#rows live back to back in a single flat array of doubles
+class SampleBatch:
+	def __init__(self, values=None):
+		self.values = values if values is not None else array.array('d')
+
+	def __len__(self):
+		return len(self.values) // SAMPLE_FIELDS
+
+	def add(self, timestamp, pose, gas):
+		self.values.extend((timestamp, pose[0], pose[1], pose[2], gas[0], gas[1], gas[2], gas[3]))
+
+	#returns the rows as (timestamp, [x, y, theta], [gas0..gas3])
+	def rows(self):
+		v = self.values
+		for i in range(0, len(v), SAMPLE_FIELDS):
+			yield v[i], list(v[i+1:i+4]), list(v[i+4:i+SAMPLE_FIELDS])
+
+	#newest row, same shape as rows()
+	def last(self):
+		v = self.values[-SAMPLE_FIELDS:]
+		return v[0], list(v[1:4]), list(v[4:])
+
+#robot side: collects samples and ships them as one MSG_SAMPLES frame
+#once there are maxRows of them or the oldest has waited maxAge seconds
+#send is whatever puts a message on the wire, e.g. DuplexLink.send
+class SampleBatcher:
+	def __init__(self, send, maxRows=32, maxAge=.1):
+		self.send = send
+		self.maxRows = min(maxRows, MAX_SAMPLE_ROWS)
+		self.maxAge = maxAge
+		self.batch = SampleBatch()
+		self.oldest = 0
+		self.lock = threading.Lock()
+		#counters
+		self.frames = 0
+		self.samples = 0
+
+	def add(self, timestamp, pose, gas):
+		with self.lock:
+			if len(self.batch) == 0:
+				self.oldest = time.time()
+			self.batch.add(timestamp, pose, gas)
+			full = len(self.batch) >= self.maxRows or time.time() - self.oldest >= self.maxAge
+		if full:
+			self.flush()
+
+	#send whatever is waiting, if anything
+	def flush(self):
+		with self.lock:
+			if len(self.batch) == 0:
+				return
+			batch = self.batch
+			self.batch = SampleBatch()
+		self.send(batch)
+		self.frames += 1
+		self.samples += len(batch)
+
+#messages that can only be one thing get their layout without being told
+#telemetry and commands have to be asked for (msgtype), a list is just a list otherwise
+def messageType(message):
+	kind = type(message)
+	if kind is int:
+		return MSG_ID
+	elif kind is str and message == "out":
+		return MSG_OUT
+	elif kind is SampleBatch:
+		return MSG_SAMPLES
+	return MSG_PICKLE
+
+#whether message is exactly what the msgtype layout holds, element types and all
+#anything else would come out the other end changed, so it gets pickled instead
+#spelled out rather than looped, this runs for every frame
+def fits(message, msgtype):
+	if msgtype == MSG_TELEMETRY:
+		if type(message) is not list or len(message) != 2:
+			return False
+		pos, gas = message
+		return (type(pos) is list and len(pos) == 3
+			and type(pos[0]) is float and type(pos[1]) is float and type(pos[2]) is float
+			and type(gas) is list and len(gas) == 4
+			and type(gas[0]) is float and type(gas[1]) is float and type(gas[2]) is float and type(gas[3]) is float)
+	if msgtype == MSG_COMMAND:
+		return (type(message) is list and len(message) == 6
+			and type(message[0]) is float and type(message[1]) is float and type(message[2]) is int
+			and type(message[3]) is float and type(message[4]) is float and type(message[5]) is float)
+	if msgtype == MSG_ID:
+		return type(message) is int
+	if msgtype == MSG_OUT:
+		return message == "out"
+	if msgtype == MSG_SAMPLES:
+		return type(message) is SampleBatch
+	return msgtype == MSG_PICKLE
+
+#[curpos, gas] in the telemetry layout's types
+def telemetry(pos, gas):
+	return [[float(v) for v in pos], [float(v) for v in gas]]
+
+#desired [x_dot, y_dot, gas index, AT x, AT y, AT theta] in the command layout's types
+#the gas index is a sensor number, so it must already be whole
+def command(desired):
+	return [float(desired[0]), float(desired[1]), int(desired[2]), float(desired[3]), float(desired[4]), float(desired[5])]
+
+#takes message, returns packet
+#msgtype asks for a layout, a message that doesn't fit it exactly is pickled
+def makePacket(message, msgtype=None, seq=0, ack=0):
+	if msgtype is None:
+		msgtype = messageType(message)
+	elif not fits(message, msgtype):
+		msgtype = MSG_PICKLE
+	if msgtype == MSG_SAMPLES and len(message) > MAX_SAMPLE_ROWS:
+		raise ValueError("%d samples don't fit in one frame" % len(message))
+	try:
+		if msgtype == MSG_TELEMETRY:
+			pos, gas = message
+			return LAYOUTS[MSG_TELEMETRY].pack(LAYOUTS[MSG_TELEMETRY].size - HEADER_SIZE, PROTOCOL_VERSION, MSG_TELEMETRY, seq, ack,
+				pos[0], pos[1], pos[2], gas[0], gas[1], gas[2], gas[3])
+		if msgtype == MSG_COMMAND:
+			return LAYOUTS[MSG_COMMAND].pack(LAYOUTS[MSG_COMMAND].size - HEADER_SIZE, PROTOCOL_VERSION, MSG_COMMAND, seq, ack,
+				message[0], message[1], message[2], message[3], message[4], message[5])
+		if msgtype == MSG_ID:
+			return LAYOUTS[MSG_ID].pack(LAYOUTS[MSG_ID].size - HEADER_SIZE, PROTOCOL_VERSION, MSG_ID, seq, ack, message)
+		if msgtype == MSG_OUT:
+			return FRAME_HEADER.pack(FRAME_HEADER.size - HEADER_SIZE, PROTOCOL_VERSION, MSG_OUT, seq, ack)
+		if msgtype == MSG_SAMPLES:
+			values = message.values
+			if sys.byteorder != ENDIANNESS:
+				values = array.array('d', values)
+				values.byteswap()
+			payload = values.tobytes()
+			return FRAME_HEADER.pack(FRAME_HEADER.size - HEADER_SIZE + len(payload), PROTOCOL_VERSION, MSG_SAMPLES, seq, ack) + payload
+	except (struct.error, TypeError, ValueError):
+		#doesn't fit the layout after all (wrong types, out of range)
+		pass
+	#encode the message using pickle (serializes)
+	pmsg = pickle.dumps(message)
+	#get byte size of everything after the length
+	size = FRAME_HEADER.size - HEADER_SIZE + len(pmsg)
+	#create bytearray message
+	packet = FRAME_HEADER.pack(size, PROTOCOL_VERSION, MSG_PICKLE, seq, ack)
+	packet += pmsg
+	return packet
 
 
 #takes packet, reads size, returns message
 def unmakePacket(packet):
-	#read size
-	bsize = packet[:2]
-	size = int.from_bytes(bsize, byteorder=ENDIANNESS)
+	return unmakeFrame(packet).msg
+
+#takes packet, returns Frame with the sequence numbers and the message
+#fixed layouts are unpacked header and all in one go
+def unmakeFrame(packet):
+	#version and type are the two bytes after the length
+	version = packet[HEADER_SIZE]
+	if version != PROTOCOL_VERSION:
+		raise ValueError("protocol version %s, expected %s" % (version, PROTOCOL_VERSION))
+	msgtype = packet[HEADER_SIZE + 1]
 	#take message
-	msg = pickle.loads(packet[2:(2+size)])
+	if msgtype == MSG_TELEMETRY:
+		values = LAYOUTS[MSG_TELEMETRY].unpack_from(packet)
+		msg = [list(values[5:8]), list(values[8:])]
+	elif msgtype == MSG_COMMAND:
+		values = LAYOUTS[MSG_COMMAND].unpack_from(packet)
+		msg = list(values[HEADER_FIELDS:])
+	elif msgtype == MSG_ID:
+		values = LAYOUTS[MSG_ID].unpack_from(packet)
+		msg = values[HEADER_FIELDS]
+	else:
+		values = FRAME_HEADER.unpack_from(packet)
+		size = values[0]
+		if msgtype == MSG_OUT:
+			msg = "out"
+		elif msgtype == MSG_SAMPLES:
+			samples = array.array('d')
+			samples.frombytes(packet[FRAME_HEADER.size:(HEADER_SIZE+size)])
+			if sys.byteorder != ENDIANNESS:
+				samples.byteswap()
+			msg = SampleBatch(samples)
+		elif msgtype == MSG_PICKLE:
+			msg = pickle.loads(packet[FRAME_HEADER.size:(HEADER_SIZE+size)])
+		else:
+			raise ValueError("unknown message type %s" % msgtype)
+	return Frame(values[3], values[4], msg)
+
+#buffered reader for one connection
+#TCP is a stream so a single recv can hold half a frame or several frames glued
+#together. keep the bytes in one preallocated buffer and only hand out whole frames
+class FrameReader:
+	def __init__(self, sock, size=buffer_size):
+		self.sock = sock
+		self.buf = bytearray(size)
+		self.view = memoryview(self.buf)
+		self.start = 0	#first byte not yet decoded
+		self.end = 0	#one past the last byte recieved
+		self.frames = collections.deque()	#decoded but not yet handed out
+
+	#length of the whole frame at the front of the buffer
+	#returns 0 if the header isn't in yet
+	def frameLength(self):
+		if self.end - self.start < HEADER_SIZE:
+			return 0
+		size = int.from_bytes(self.view[self.start:(self.start+HEADER_SIZE)], byteorder=ENDIANNESS)
+		return HEADER_SIZE + size
+
+	#decode every complete frame sitting in the buffer
+	def decodeFrames(self):
+		while True:
+			length = self.frameLength()
+			if length == 0 or (self.end - self.start) < length:
+				return
+			self.frames.append(unmakeFrame(packet=self.view[self.start:(self.start+length)]))
+			self.start += length
 
-	return msg
+	#one recv_into the free space at the back of the buffer
+	#slides the leftover partial frame to the front first if it's needed
+	def fill(self):
+		pending = self.end - self.start
+		if pending == 0:
+			self.start = self.end = 0
+		elif self.start > 0 and (len(self.buf) - self.end) < max(self.frameLength() - pending, 1):
+			self.buf[:pending] = self.buf[self.start:self.end]
+			self.start, self.end = 0, pending
+		#frame bigger than the whole buffer, make room once and keep it
+		length = self.frameLength()
+		if length > len(self.buf):
+			self.view.release()
+			self.buf.extend(bytes(length - len(self.buf)))
+			self.view = memoryview(self.buf)
+
+		n = self.sock.recv_into(self.view[self.end:])
+		if n == 0:
+			raise EOFError("connection closed")
+		self.end += n
+		self.decodeFrames()
+
+	#blocks until one whole frame is in and returns its message
+	def read(self):
+		while not self.frames:
+			self.fill()
+		return self.frames.popleft().msg
+
+	#blocks until at least one frame is in
+	#returns every message that came in with it as a list, oldest first
+	def readAll(self):
+		return [frame.msg for frame in self.readFrames()]
+
+	#same as readAll but hands back the whole Frames, sequence numbers and all
+	def readFrames(self):
+		while not self.frames:
+			self.fill()
+		frames = list(self.frames)
+		self.frames.clear()
+		return frames
+
+#one reader per socket, dropped along with the socket
+_readers = weakref.WeakKeyDictionary()
+
+def getReader(sock):
+	reader = _readers.get(sock)
+	if reader is None:
+		reader = FrameReader(sock)
+		_readers[sock] = reader
+	return reader
+
+#full duplex connection
+#instead of taking turns both ends send whenever they have something new.
+#a reader thread takes in everything from the other side and keeps the newest
+#message around, so the control loop never sits waiting on the network
+class DuplexLink:
+	def __init__(self, sock, onMessage=None):
+		self.sock = sock
+		self.reader = getReader(sock)
+		#called from the reader thread with every message, in order
+		self.onMessage = onMessage
+
+		self.sendLock = threading.Lock()
+		self.newMsg = threading.Condition()
+		self.closed = False
+
+		self.seq = 0		#last seq we sent
+		self.ack = 0		#newest seq recieved from the other side
+		self.peerAck = 0	#newest of our seqs the other side has seen
+		self.latest = None	#newest message recieved
+		self.latestTime = 0
+		self.unread = False	#latest hasn't been taken with newest() yet
+
+		#counters
+		self.sent = 0
+		self.recieved = 0
+		self.superseded = 0	#replaced by a newer message before anyone took it
+
+		self.thread = threading.Thread(target=self.recieveLoop, daemon=True)
+
+	def start(self):
+		self.thread.start()
+		return self
+
+	#sends message tagged with the next seq
+	#returns the seq it went out with
+	def send(self, message, msgtype=None):
+		with self.sendLock:
+			self.seq = (self.seq + 1) & 0xFFFFFFFF
+			packet = makePacket(message, msgtype, seq=self.seq, ack=self.ack)
+			self.sock.sendall(packet)
+			self.sent += 1
+			return self.seq
+
+	def recieveLoop(self):
+		try:
+			while not self.closed:
+				frames = self.reader.readFrames()
+				if self.onMessage is not None:
+					for frame in frames:
+						self.onMessage(frame.msg)
+				newest = frames[-1]
+				with self.newMsg:
+					self.superseded += len(frames) - 1 + (1 if self.unread else 0)
+					self.recieved += len(frames)
+					self.ack = newest.seq
+					self.peerAck = newest.ack
+					self.latest = newest.msg
+					self.latestTime = time.time()
+					self.unread = True
+					self.newMsg.notify_all()
+		except (OSError, EOFError, ValueError):
+			pass
+		finally:
+			with self.newMsg:
+				self.closed = True
+				self.newMsg.notify_all()
+
+	#takes the newest message if it hasn't been taken yet
+	#waits up to timeout seconds for one to come in (0 doesn't wait, None waits forever)
+	#returns None if there is nothing new
+	def newest(self, timeout=0):
+		with self.newMsg:
+			if timeout != 0:
+				self.newMsg.wait_for(lambda: self.unread or self.closed, timeout)
+			if not self.unread:
+				return None
+			self.unread = False
+			return self.latest
+
+	def close(self):
+		self.closed = True
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		self.sock.close()
 
 #takes message and socket, creates packet, sends packet over socket
 #returns exception if created
-def sendPacket(sock, message):
+def sendPacket(sock, message, msgtype=None):
 	#make and send packet
-	packet = makePacket(message=message)
+	packet = makePacket(message=message, msgtype=msgtype)
 	sock.sendall(packet)
 
 #takes socket and waits for message
@@ -60,6 +433,28 @@ def sendPacket(sock, message):
 #returns error if unsuccessful
 def recievePacket(sock):
 	#recieve and decode
-	pkt = sock.recv(buffer_size)
-	msg = unmakePacket(packet=pkt)
-	return msg
+	return getReader(sock).read()
+
+#takes socket and waits for at least one message
+#returns every message already queued up on the socket as a list
+def recievePackets(sock):
+	return getReader(sock).readAll()
+
+#asyncio versions for StreamReader/StreamWriter connections
+#StreamReader does the buffering, these just cut it into frames
+
+#waits for one whole frame, returns it as a Frame
+async def recieveFrameAsync(reader):
+	head = await reader.readexactly(HEADER_SIZE)
+	size = int.from_bytes(head, byteorder=ENDIANNESS)
+	body = await reader.readexactly(size)
+	return unmakeFrame(head + body)
+
+#waits for one whole frame, returns its message
+async def recievePacketAsync(reader):
+	return (await recieveFrameAsync(reader)).msg
+
+#creates packet and sends it, waits until the writer's buffer has room again
+async def sendPacketAsync(writer, message, msgtype=None, seq=0, ack=0):
+	writer.write(makePacket(message, msgtype, seq=seq, ack=ack))
+	await writer.drain()
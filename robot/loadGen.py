@@ -0,0 +1,290 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# loadGen.py
+#
+# Fleet load generator for stress testing the base
+# runs hundreds of fake robots from one process, each one talking the real
+# encoding_TCP protocol to Base.py, and reports how the base keeps up
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import sys
+import math
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.append('libs/')
+from libs.custom_libs import encoding_TCP as encode
+
+
+# numbers for the whole fleet, only counted once the base has settled in
+# except lost, robots that couldn't connect or were cut off are counted from the start
+class LoadStats:
+	def __init__(self):
+		self.lost = 0
+		self.reset()
+
+	def reset(self):
+		self.start = time.time()
+		self.sent = 0
+		self.recieved = 0
+		self.dropped = 0
+		self.rtts = []
+
+	@staticmethod
+	def percentile(values, q):
+		if not values:
+			return float('nan')
+		values = sorted(values)
+		return values[min(len(values) - 1, int(q * len(values)))]
+
+	def report(self, connected):
+		elapsed = time.time() - self.start
+		return ("%d robots connected | sent %.0f msg/s recieved %.0f msg/s | "
+				"rtt ms p50 %.2f p99 %.2f | dropped %d | lost %d robots") % (
+			connected, self.sent / elapsed, self.recieved / elapsed,
+			LoadStats.percentile(self.rtts, .5) * 1000, LoadStats.percentile(self.rtts, .99) * 1000,
+			self.dropped, self.lost)
+
+
+# one fake robot
+# wanders around the field and makes up gas readings
+class SimRobot:
+	def __init__(self, id, args, stats):
+		self.id = id
+		self.args = args
+		self.stats = stats
+		self.period = 1.0 / args.rate
+		self.connected = False
+		self.stopped = asyncio.Event()	# every loop ends once this is set
+		self.writer = None
+
+		self.curpos = [random.uniform(-2, 2), random.uniform(-2, 2), random.uniform(0, 2 * math.pi)]
+		self.batch = encode.SampleBatch()
+		self.msgtype = encode.MSG_SAMPLES if args.batch else encode.MSG_TELEMETRY
+
+	def step(self):
+		self.curpos[2] = math.fmod(self.curpos[2] + random.gauss(0, .05), 2 * math.pi)
+		self.curpos[0] += .01 * math.cos(self.curpos[2])
+		self.curpos[1] += .01 * math.sin(self.curpos[2])
+		gas = [400 + random.gauss(0, 20) for i in range(4)]
+		return [list(self.curpos), gas]
+
+	# next thing to send, None while a batch is still filling
+	def nextMessage(self):
+		pos, gas = self.step()
+		if not self.args.batch:
+			return encode.telemetry(pos, gas)
+		self.batch.add(time.time(), pos, gas)
+		if len(self.batch) < self.args.batch:
+			return None
+		batch = self.batch
+		self.batch = encode.SampleBatch()
+		return batch
+
+	# wait out delay (s), True if the robot was stopped in the meantime
+	async def wait(self, delay):
+		try:
+			await asyncio.wait_for(self.stopped.wait(), max(0, delay))
+		except asyncio.TimeoutError:
+			return False
+		return True
+
+	# end every loop and close the connection, so a read in progress fails
+	# instead of waiting on a base that's still answering
+	def stop(self):
+		self.stopped.set()
+		if self.writer is not None:
+			self.writer.close()
+
+	async def run(self):
+		try:
+			reader, writer = await asyncio.open_connection(self.args.ip, self.args.port)
+		except OSError:
+			self.stats.lost += 1
+			return
+		self.writer = writer
+		self.connected = True
+		try:
+			if self.stopped.is_set():
+				return
+			await encode.sendPacketAsync(writer, self.id)
+			if self.args.duplex:
+				await self.runDuplex(reader, writer)
+			else:
+				await self.runLockstep(reader, writer)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			# the connection going away is how a stopped robot's reads end
+			if not self.stopped.is_set():
+				self.stats.lost += 1
+		finally:
+			self.connected = False
+			writer.close()
+
+	# send, wait for the answer, repeat at the given rate
+	# the first answer comes after the base's warm up, so it isn't timed out
+	async def runLockstep(self, reader, writer):
+		loop = asyncio.get_running_loop()
+		nextSend = loop.time()
+		timeout = None
+		while not self.stopped.is_set():
+			msg = self.nextMessage()
+			if msg is not None:
+				sent = time.time()
+				await encode.sendPacketAsync(writer, msg, self.msgtype)
+				self.stats.sent += 1
+				try:
+					rcv = await asyncio.wait_for(encode.recievePacketAsync(reader), timeout)
+				except asyncio.TimeoutError:
+					# can't stay in step after a missed reply
+					self.stats.dropped += 1
+					self.stats.lost += 1
+					return
+				timeout = self.args.timeout
+				self.stats.recieved += 1
+				if sent >= self.stats.start:
+					self.stats.rtts.append(time.time() - sent)
+				if rcv == "out":
+					await encode.sendPacketAsync(writer, "out")
+					return
+			nextSend += self.period
+			await self.wait(nextSend - loop.time())
+
+	# stream telemetry at the given rate, take commands as they come
+	# rtt is from sending a frame to the first command that acks it
+	async def runDuplex(self, reader, writer):
+		sendTimes = {}
+		state = {'seq': 0, 'ack': 0, 'acked': 0, 'lastCmd': 0}
+
+		async def send():
+			loop = asyncio.get_running_loop()
+			nextSend = loop.time()
+			while not self.stopped.is_set():
+				msg = self.nextMessage()
+				if msg is not None:
+					state['seq'] += 1
+					sendTimes[state['seq']] = time.time()
+					writer.write(encode.makePacket(msg, self.msgtype, seq=state['seq'], ack=state['ack']))
+					await writer.drain()
+					self.stats.sent += 1
+				nextSend += self.period
+				await self.wait(nextSend - loop.time())
+
+		sender = asyncio.ensure_future(send())
+		try:
+			while not self.stopped.is_set():
+				frame = await encode.recieveFrameAsync(reader)
+				self.stats.recieved += 1
+				if frame.msg == "out":
+					writer.write(encode.makePacket("out", seq=state['seq'] + 1, ack=frame.seq))
+					await writer.drain()
+					return
+				# base skipped some of its own commands
+				if state['lastCmd'] and frame.seq > state['lastCmd'] + 1:
+					self.stats.dropped += frame.seq - state['lastCmd'] - 1
+				state['lastCmd'] = frame.seq
+				state['ack'] = frame.seq
+				if frame.ack > state['acked']:
+					sent = sendTimes.get(frame.ack)
+					if sent is not None and sent >= self.stats.start:
+						self.stats.rtts.append(time.time() - sent)
+					for seq in range(state['acked'] + 1, frame.ack + 1):
+						sendTimes.pop(seq, None)
+					state['acked'] = frame.ack
+		finally:
+			sender.cancel()
+
+
+# stands in for the field camera so the base has a tag pose for every robot
+# speaks the same length\npayload format as Field.cpp
+async def feedTags(robots, args, stopped):
+	reader, writer = await asyncio.open_connection(args.tagip, args.tagport)
+	try:
+		while not stopped.is_set():
+			for robot in robots:
+				x, y, theta = robot.curpos
+				payload = ("%d,%f,%f,%f,%f,%f,%f" % (robot.id, x, y, 0, 0, theta, 0)).encode()
+				writer.write(b"%d\n" % len(payload) + payload)
+			await writer.drain()
+			try:
+				await asyncio.wait_for(stopped.wait(), 1.0 / args.tagrate)
+			except asyncio.TimeoutError:
+				pass
+	finally:
+		writer.close()
+
+
+# seconds to let the robots wind down at the end before giving up on them
+SHUTDOWN = 5
+
+
+async def main(args):
+	stats = LoadStats()
+	robots = [SimRobot(args.firstid + i, args, stats) for i in range(args.robots)]
+	stopped = asyncio.Event()
+
+	tasks = []
+	if args.tags:
+		tasks.append(asyncio.ensure_future(feedTags(robots, args, stopped)))
+	for robot in robots:
+		tasks.append(asyncio.ensure_future(robot.run()))
+		# don't hit the accept queue all at once
+		await asyncio.sleep(args.ramp / max(1, args.robots))
+
+	# the base takes a while with each new robot, don't count that
+	await asyncio.sleep(args.settle)
+	stats.reset()
+	end = time.time() + args.duration
+	while time.time() < end:
+		await asyncio.sleep(min(args.report, max(0, end - time.time())))
+		print(stats.report(sum(robot.connected for robot in robots)))
+
+	# stop first, a cancel alone can get lost in a wait_for that's just finishing
+	stopped.set()
+	for robot in robots:
+		robot.stop()
+	for task in tasks:
+		task.cancel()
+	if tasks:
+		done, stuck = await asyncio.wait(tasks, timeout=SHUTDOWN)
+		if stuck:
+			print(len(stuck), "tasks didn't stop in time")
+	print("final:", stats.report(0))
+	return stats
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--ip", dest='ip', type=str, help="IP address of the base", default="127.0.0.1")
+	parser.add_argument("--port", dest='port', type=int, help="base port", default=5732)
+	parser.add_argument("--robots", dest='robots', type=int, help="fake robots to run", default=100)
+	parser.add_argument("--firstid", dest='firstid', type=int, help="ID of the first fake robot, the rest count up", default=0)
+	parser.add_argument("--rate", dest='rate', type=float, help="messages per second per robot", default=10)
+	parser.add_argument("--duplex", dest='duplex', action='store_true', help="stream instead of taking turns (base needs --DUPLEX)")
+	parser.add_argument("--batch", dest='batch', type=int, help="send readings in batches of this many (needs --duplex)", default=0)
+	parser.add_argument("--timeout", dest='timeout', type=float, help="seconds to wait on a lockstep reply before counting it dropped, the first one waits out the base's warm up", default=5)
+	parser.add_argument("--duration", dest='duration', type=float, help="seconds to measure for", default=30)
+	parser.add_argument("--settle", dest='settle', type=float, help="seconds to wait after connecting before measuring (base warm up is 10)", default=12)
+	parser.add_argument("--ramp", dest='ramp', type=float, help="seconds to spread the connections over", default=2)
+	parser.add_argument("--report", dest='report', type=float, help="seconds between reports", default=5)
+	parser.add_argument("--tags", dest='tags', action='store_true', help="also fake the field camera so the base has a tag for every robot")
+	parser.add_argument("--tagip", dest='tagip', type=str, help="AprilTag server address (only listens on localhost)", default="127.0.0.1")
+	parser.add_argument("--tagport", dest='tagport', type=int, help="AprilTag server port", default=9999)
+	parser.add_argument("--tagrate", dest='tagrate', type=float, help="fake camera frames per second", default=30)
+	args = parser.parse_args()
+	if args.batch and not args.duplex:
+		parser.error("--batch needs --duplex")
+	try:
+		asyncio.run(main(args))
+	except KeyboardInterrupt:
+		sys.exit()
@@ -0,0 +1,103 @@
+# ______ _                       ___  ______________
+# | ___ \ |                      |  \/  |  _  | ___ \
+# | |_/ / |_   _ _ __ ___   ___  | .  . | | | | |_/ /
+# |  __/| | | | | '_ ` _ \ / _ \ | |\/| | | | |  __/
+# | |   | | |_| | | | | | |  __/ | |  | \ \/' / |
+# \_|   |_|\__,_|_| |_| |_|\___| \_|  |_/\_/\_\_|
+#
+#
+# test_loadGen.py
+#
+# The load generator has to wind down on its own once the run is over,
+# whether the base is answering, streaming, or hasn't said anything yet
+# run from this directory: python3 -m pytest test_loadGen.py
+#
+# Ryan Wiesenberg
+# Eric Fast
+# Stepthen Harnais
+
+import asyncio
+import argparse
+import unittest
+
+import loadGen
+from libs.custom_libs import encoding_TCP as encode
+
+
+# stands in for Base.py
+# answers every frame with a command straight away, or never if silent
+class StubBase:
+	def __init__(self, silent=False):
+		self.silent = silent
+		self.robots = 0
+
+	async def handle(self, reader, writer):
+		self.robots += 1
+		try:
+			await encode.recieveFrameAsync(reader)	# ID
+			seq = 0
+			while True:
+				frame = await encode.recieveFrameAsync(reader)
+				if frame.msg == "out" or self.silent:
+					continue
+				seq += 1
+				writer.write(encode.makePacket(encode.command([1, 2, 0, 3, 4, 5]), encode.MSG_COMMAND, seq=seq, ack=frame.seq))
+				await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def start(self):
+		self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+		return self.server.sockets[0].getsockname()[1]
+
+
+def loadArgs(port, **changes):
+	args = argparse.Namespace(ip='127.0.0.1', port=port, robots=20, firstid=0, rate=50, duplex=False, batch=0,
+							  timeout=5, duration=.5, settle=0, ramp=0, report=.5, tags=False)
+	for name, value in changes.items():
+		setattr(args, name, value)
+	return args
+
+
+class TestShutdown(unittest.TestCase):
+	# main has to be back well inside this (s)
+	LIMIT = 10
+
+	def runLoad(self, silent=False, **changes):
+		async def go():
+			base = StubBase(silent)
+			port = await base.start()
+			try:
+				stats = await asyncio.wait_for(loadGen.main(loadArgs(port, **changes)), self.LIMIT)
+			finally:
+				base.server.close()
+			return base, stats
+		return asyncio.run(go())
+
+	def testLockstep(self):
+		base, stats = self.runLoad()
+		self.assertEqual(base.robots, 20)
+		self.assertGreater(stats.recieved, 0)
+		self.assertEqual(stats.lost, 0)
+
+	# every robot is sitting on its first reply, which has no timeout
+	def testLockstepNoReply(self):
+		base, stats = self.runLoad(silent=True)
+		self.assertEqual(stats.recieved, 0)
+		self.assertEqual(stats.lost, 0)
+
+	def testDuplex(self):
+		base, stats = self.runLoad(duplex=True)
+		self.assertGreater(stats.recieved, 0)
+		self.assertEqual(stats.lost, 0)
+
+	def testBatch(self):
+		base, stats = self.runLoad(duplex=True, batch=5)
+		self.assertGreater(stats.sent, 0)
+		self.assertEqual(stats.lost, 0)
+
+
+if __name__ == "__main__":
+	unittest.main()